@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""Compare memory usage and parsing time of GiveawayRecord against the former GiveawayData dicts
+
+Usage: python -m benchmarks.giveaway_records [giveaways_count]"""
+
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+
+from src.modules.giveaways.types import GiveawayRecord, RawGiveawayData
+
+
+def generate_snapshot(count: int) -> dict[str, RawGiveawayData]:
+    "Generate a fake 'giveaways' RTDB snapshot"
+    start = datetime(2023, 1, 1, tzinfo=timezone.utc)
+    return {
+        f"{i:032x}": {
+            "guild": 125723125685026816,
+            "channel": 1087750633138798603,
+            "message": 1087750633138798603 + i,
+            "name": f"Giveaway #{i}",
+            "description": "Win a brand new keyboard!",
+            "color": 0x9933ff,
+            "max_entries": None,
+            "required_role": None,
+            "winners_count": 3,
+            "ends_at": (start + timedelta(minutes=i)).isoformat(),
+            "ended": True,
+            "winners": [279568324260528128, 125722240896598016],
+        }
+        for i in range(count)
+    }
+
+def parse_as_dicts(snapshot: dict[str, RawGiveawayData]):
+    "Former FirebaseDB parsing, into GiveawayData dicts"
+    return [
+        {
+            **gaw,
+            "id": gaw_id,
+            "ends_at": datetime.fromisoformat(gaw["ends_at"]),
+            "winners": gaw.get("winners", [])
+        }
+        for gaw_id, gaw in snapshot.items()
+    ]
+
+def parse_as_records(snapshot: dict[str, RawGiveawayData]):
+    "Current FirebaseDB parsing, into GiveawayRecord instances"
+    return [
+        GiveawayRecord.from_raw(gaw_id, gaw)
+        for gaw_id, gaw in snapshot.items()
+    ]
+
+def measure(parser: Callable[[dict[str, RawGiveawayData]], list], snapshot: dict[str, RawGiveawayData]):
+    "Measure the parsing duration, the retained memory and the time to read every end date"
+    start = time.perf_counter()
+    parsed = parser(snapshot)
+    parse_duration = time.perf_counter() - start
+    start = time.perf_counter()
+    for gaw in parsed:
+        _ = gaw["ends_at"]
+    dates_duration = time.perf_counter() - start
+    del parsed
+    tracemalloc.start()
+    parsed = parser(snapshot)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return parse_duration, dates_duration, memory
+
+def main():
+    "Run the benchmark and print the results"
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    snapshot = generate_snapshot(count)
+    print(f"Parsing {count} giveaways")
+    for name, parser in (("GiveawayData dicts", parse_as_dicts), ("GiveawayRecord", parse_as_records)):
+        parse_duration, dates_duration, memory = measure(parser, snapshot)
+        print(f"{name:>20}: parse {parse_duration*1000:7.1f}ms | read all end dates {dates_duration*1000:7.1f}ms \
+| memory {memory/1024/1024:6.2f}MiB ({memory/count:.0f}B/giveaway)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""Simulate days of giveaways in a few seconds, by driving the giveaways cog with a manual clock against an in-memory
+SQLite storage, and check that every giveaway is closed exactly once with valid winners
+Runs are deterministic for a given seed. Every due giveaway is closed twice concurrently, like two bot instances would.
+
+Usage: python -m benchmarks.giveaways_simulation [giveaways_count] [days] [seed]
+(from the bot directory, as the cog module reads config.json)"""
+
+import asyncio
+import random
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+import discord
+
+from src.modules.giveaways.main import GiveawaysCog
+from src.modules.giveaways.types import GiveawayRecord
+from src.storage.sqlite import SQLiteStorage
+from src.utils.clock import ManualClock
+
+START = datetime(2023, 1, 1, tzinfo=timezone.utc)
+STEP = timedelta(minutes=5)
+USERS_COUNT = 5000
+
+
+class FakeBot:
+    "The parts of CObot used by the giveaways cog to close giveaways"
+
+    def __init__(self, fb: SQLiteStorage, clock: ManualClock):
+        self.fb = fb
+        self.clock = clock
+        self.config: dict = {}
+        self.errors: list[BaseException] = []
+
+    def get_guild(self, _guild_id: int):
+        "Members are never cached, so every participant is eligible"
+        return None
+
+    def dispatch(self, event: str, *args):
+        "Keep the dispatched errors"
+        if event == "error":
+            self.errors.append(args[0])
+
+    @contextmanager
+    def track_work(self):
+        "Nothing to drain"
+        yield
+
+
+class FakeMessage:
+    "Giveaway message, keeping the announcements replied to it"
+
+    def __init__(self, announcements: list[str]):
+        self.embeds = [discord.Embed().add_field(name="Participants", value="0")]
+        self.announcements = announcements
+
+    async def edit(self, **_kwargs):
+        "Nothing to edit"
+
+    async def reply(self, content: str):
+        "Record an announcement"
+        self.announcements.append(content)
+
+
+def create_cog(bot: FakeBot, announcements: dict[str, list[str]]) -> GiveawaysCog:
+    "Create the giveaways cog, whose giveaway messages record the announcements replied to them"
+    cog = GiveawaysCog(bot) # type: ignore
+
+    async def fetch_gaw_message(data: GiveawayRecord):
+        return FakeMessage(announcements.setdefault(data.id, []))
+
+    cog.fetch_gaw_message = fetch_gaw_message # type: ignore
+    return cog
+
+async def create_giveaways(fb: SQLiteStorage, rng: random.Random, giveaways_count: int, days: int):
+    "Create giveaways ending at random dates over the simulated days"
+    for i in range(giveaways_count):
+        await fb.create_giveaway({
+            "id": f"gaw{i:05d}", "guild": rng.randrange(1, 20), "channel": 1, "message": i, "name": f"Giveaway {i}",
+            "description": "", "color": 0, "max_entries": None, "required_role": None,
+            "winners_count": rng.randint(1, 3), "ends_at": START + timedelta(minutes=rng.randrange(days * 24 * 60)),
+            "ended": False, "winners": [],
+        })
+
+async def simulate(giveaways_count: int, days: int, seed: int):
+    """Run the simulation, and return the storage, the bot, the announcements of each giveaway and the number of
+    archived giveaways"""
+    rng = random.Random(seed)
+    # winners are picked with the random module
+    random.seed(seed)
+    clock = ManualClock(START)
+    fb = SQLiteStorage(":memory:", clock=clock)
+    bot = FakeBot(fb, clock)
+    announcements: dict[str, list[str]] = {}
+    cog = create_cog(bot, announcements)
+    await create_giveaways(fb, rng, giveaways_count, days)
+    end = START + timedelta(days=days)
+    archived_count = 0
+    while clock.now() < end:
+        active_giveaways = await fb.query_giveaways(ended=False)
+        for gaw in rng.sample(active_giveaways, min(len(active_giveaways), 10)):
+            user_id = rng.randrange(USERS_COUNT)
+            if not await fb.check_giveaway_participant(gaw.id, user_id):
+                await fb.add_giveaway_participant(gaw.id, user_id)
+        clock.advance(STEP)
+        for gaw in await fb.query_giveaways(ended=False, ends_before=clock.now()):
+            await asyncio.gather(cog.close_giveaway(gaw), cog.close_giveaway(gaw))
+        if clock.now().timestamp() % 86400 == 0:
+            archived_count += await fb.archive_giveaways(clock.now() - timedelta(days=1))
+    await fb.flush_writes()
+    return fb, bot, announcements, archived_count
+
+async def check(fb: SQLiteStorage, giveaways_count: int, announcements: dict[str, list[str]]):
+    "Check that every giveaway was closed once with valid winners, and return the number of picked winners"
+    winners_count = 0
+    for i in range(giveaways_count):
+        gaw = await fb.get_giveaway(f"gaw{i:05d}", include_archived=True)
+        if gaw is None or not gaw.ended:
+            raise RuntimeError(f"Giveaway {i} was not closed")
+        if len(announcements.get(gaw.id, [])) != 1:
+            raise RuntimeError(f"Giveaway {gaw.id} was announced {len(announcements.get(gaw.id, []))} times")
+        participants = set(await fb.get_giveaways_participants(gaw.id) or [])
+        if len(set(gaw.winners)) != len(gaw.winners) or not participants.issuperset(gaw.winners) \
+                or len(gaw.winners) != min(gaw.winners_count, len(participants)):
+            raise RuntimeError(f"Giveaway {gaw.id} has invalid winners {gaw.winners}")
+        winners_count += len(gaw.winners)
+    return winners_count
+
+async def main():
+    "Run the simulation and print the results"
+    giveaways_count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 7
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    start = time.perf_counter()
+    fb, bot, announcements, archived_count = await simulate(giveaways_count, days, seed)
+    duration = time.perf_counter() - start
+    if bot.errors:
+        raise RuntimeError(f"{len(bot.errors)} errors were dispatched, the first one being {bot.errors[0]!r}")
+    winners_count = await check(fb, giveaways_count, announcements)
+    await fb.close()
+    print(f"{giveaways_count} giveaways over {days} days simulated in {duration:.2f}s (seed {seed})")
+    print(f"Every giveaway closed once: {winners_count} winners picked, {archived_count} giveaways archived")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""Compare the transfer size and parse time of the one-key-per-user and packed participants formats
+
+Usage: python -m benchmarks.packed_participants [participants_count]"""
+
+import gzip
+import json
+import sys
+import time
+
+from src.firebase.packing import CHUNK_SIZE, chunk_key, pack_chunk, unpack_chunk_ids
+
+
+def fake_participants(count: int):
+    "Generate fake (user ID, join timestamp in ms) participants"
+    return [(279568324260528128 + i * 4194304, 1672531200000 + i * 1000) for i in range(count)]
+
+def parse_legacy(payload: bytes):
+    "Parse the participants list as FirebaseDB does for the one-key-per-user format"
+    snapshot = json.loads(payload)
+    return [int(user_id) for user_id in snapshot.keys()]
+
+def parse_packed(payload: bytes):
+    "Parse the participants list as FirebaseDB does for the packed format"
+    chunks = json.loads(payload)
+    return [user_id for key in sorted(chunks) for user_id in unpack_chunk_ids(chunks[key])]
+
+def measure(parse, payload: bytes, runs: int):
+    "Get the best parse time over a few runs"
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        parse(payload)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    "Run the benchmark and print the results"
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    participants = fake_participants(count)
+    legacy_payload = json.dumps({str(user_id): timestamp for user_id, timestamp in participants}).encode()
+    packed_payload = json.dumps({
+        chunk_key(i // CHUNK_SIZE): pack_chunk(participants[i:i + CHUNK_SIZE])
+        for i in range(0, count, CHUNK_SIZE)
+    }).encode()
+    if parse_legacy(legacy_payload) != parse_packed(packed_payload):
+        raise RuntimeError("Both formats should give the same participants")
+    print(f"{count} participants, chunks of {CHUNK_SIZE}")
+    for name, parse, payload in (("one key per user", parse_legacy, legacy_payload),
+                                 ("packed", parse_packed, packed_payload)):
+        duration = measure(parse, payload, runs=5)
+        print(f"{name:>16}: {len(payload)/1024:6.0f}KiB raw | {len(gzip.compress(payload))/1024:6.0f}KiB gzipped \
+| parsed in {duration*1000:5.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
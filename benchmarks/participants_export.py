@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""Measure the rows throughput and peak memory of the participants CSV export
+
+Usage: python -m benchmarks.participants_export [participants_count] [page_size]"""
+
+import asyncio
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+from src.modules.giveaways.export import write_participants_csv
+
+
+async def fake_pages(count: int, page_size: int):
+    "Generate pages of fake participants, as if they were fetched from the database"
+    start = datetime(2023, 1, 1, tzinfo=timezone.utc)
+    for page_start in range(0, count, page_size):
+        yield [
+            (279568324260528128 + i, start + timedelta(seconds=i))
+            for i in range(page_start, min(page_start + page_size, count))
+        ]
+        await asyncio.sleep(0)
+
+async def main():
+    "Run the benchmark and print the results"
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    page_size = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    winners = [279568324260528128 + i for i in range(0, count, count // 10 or 1)]
+    with tempfile.TemporaryFile() as file:
+        start = time.perf_counter()
+        rows_count = await write_participants_csv(file, fake_pages(count, page_size), winners)
+        duration = time.perf_counter() - start
+        file_size = file.tell()
+    # measure memory in a separate run, as tracing allocations slows everything down
+    with tempfile.TemporaryFile() as file:
+        tracemalloc.start()
+        await write_participants_csv(file, fake_pages(count, page_size), winners)
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    print(f"{rows_count} rows exported in {duration*1000:.0f}ms ({rows_count/duration:,.0f} rows/s, \
+including the fake pages generation)")
+    print(f"Compressed file size: {file_size/1024:.0f}KiB | peak memory: {peak_memory/1024:.0f}KiB")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
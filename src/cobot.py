@@ -1,14 +1,25 @@
+import asyncio
+import hashlib
+import json
 import logging
 import sys
-from typing import Optional, Union
+import time
+from typing import TYPE_CHECKING, Optional, Union
 
 import discord
 from discord.ext import commands
 
 from src.firebase.client import FirebaseDB
+from src.storage.base import GiveawaysStorage
+from src.storage.sqlite import SQLiteStorage
+from src.utils.clock import Clock, WarpClock
+from src.utils.shutdown import ShutdownState
 
 from .config import Config
 
+if TYPE_CHECKING:
+    from src.utils.paginator_view import StatelessPaginator
+
 
 class CObot(commands.Bot):
     "Bot class, with everything required to run it"
@@ -30,15 +41,64 @@ class CObot(commands.Bot):
         self.beta = beta # if the bot is in beta mode
         self.log = logging.getLogger("cobot")
         self.zws = "\u200B"  # here's a zero width space
-        self.fb = FirebaseDB( # firebase client
+        # source of the current time for giveaways, which can run faster than real time for testing purposes
+        if warp_speed := self.config.get("TIME_WARP_SPEED"):
+            # warped end dates are written into the database, so keep them away from the production one
+            if self.config.get("STORAGE_BACKEND", "firebase") != "sqlite":
+                raise ValueError("TIME_WARP_SPEED can only be used with the SQLite storage")
+            self.log.warning("Time warp mode enabled, giveaways time runs %s times faster", warp_speed)
+            self.clock: Clock = WarpClock(speed=warp_speed)
+        else:
+            self.clock = Clock()
+        self.fb = self._create_storage()
+        # app commands
+        self.tree.on_error = self.on_app_cmd_error
+        self.app_commands_list: Optional[list[discord.app_commands.AppCommand]] = None
+        self.app_commands_by_name: dict[str, discord.app_commands.AppCommand] = {}
+        # graceful shutdown and restart state
+        self.shutdown_state = ShutdownState("cache_snapshot.json.gz")
+        # paginators whose state is stored in their buttons, by name
+        self.stateless_paginators: dict[str, "StatelessPaginator"] = {}
+
+
+    def _create_storage(self) -> GiveawaysStorage:
+        "Create the giveaways storage backend selected in the config (Firebase by default)"
+        backend = self.config.get("STORAGE_BACKEND", "firebase")
+        if backend == "sqlite":
+            path = self.config.get("SQLITE_DATABASE_PATH", "cobot.sqlite3")
+            self.log.info("Using the local SQLite storage at %s", path)
+            return SQLiteStorage(path, page_size=self.config.get("FIREBASE_PAGE_SIZE", 100), clock=self.clock)
+        if backend != "firebase":
+            raise ValueError(f"Unknown storage backend {backend!r}")
+        return FirebaseDB(
             "firebaseServiceAccount.json",
             realtime_url=self.config["FIREBASE_REALTIME_DATABASE_URL"],
+            guild_index=self.config.get("FIREBASE_GUILD_INDEX", False),
+            page_size=self.config.get("FIREBASE_PAGE_SIZE", 100),
+            packed_participants=self.config.get("FIREBASE_PACKED_PARTICIPANTS", False),
+            async_client=self.config.get("FIREBASE_ASYNC_CLIENT", False),
+            clock=self.clock,
             # auth_uuid=self.config["FIREBASE_REALTIME_AUTH_UUID"]
         )
-        # app commands
-        self.tree.on_error = self.on_app_cmd_error
-        self.app_commands_list: Optional[list[discord.app_commands.AppCommand]] = None
 
+    async def setup_hook(self):
+        "Load the cache saved before a restart, and sync the app commands if they changed since the last sync"
+        try:
+            self.fb.load_cache_snapshot(self.shutdown_state.cache_snapshot_file,
+                                        self.shutdown_state.cache_snapshot_max_age)
+        except (OSError, ValueError, KeyError):
+            self.log.error("Failed to load the cache snapshot", exc_info=True)
+        try:
+            await self.sync_app_commands()
+        except discord.HTTPException:
+            self.log.error("Failed to sync app commands", exc_info=True)
+
+    async def close(self):
+        "Close the database connections along with the bot"
+        try:
+            await self.fb.close()
+        finally:
+            await super().close()
 
     async def on_error(self, event_method: Union[Exception, str], *_args, **_kwargs):
         "Called when an event listener raises an uncaught exception"
@@ -46,24 +106,121 @@ class CObot(commands.Bot):
             _, error, _ = sys.exc_info()
             self.dispatch("error", error, f"While handling event `{event_method}`")
 
+    async def on_interaction(self, interaction: discord.Interaction):
+        "Route clicks on stateless paginators buttons to their paginator"
+        if interaction.type != discord.InteractionType.component:
+            return
+        if not interaction.data or "custom_id" not in interaction.data:
+            return
+        custom_id: str = interaction.data["custom_id"]
+        custom_ids = custom_id.split('-', 2)
+        if len(custom_ids) != 3 or custom_ids[0] != "pg":
+            return
+        if paginator := self.stateless_paginators.get(custom_ids[1]):
+            if await self.reject_if_draining(interaction):
+                return
+            try:
+                with self.track_work():
+                    await paginator.on_click(interaction, custom_id)
+            except Exception as err: # pylint: disable=broad-except
+                self.dispatch("error", err, interaction)
+
+    def track_work(self):
+        "Mark some interaction or job as ongoing for the duration of the context, so shutdowns wait for it"
+        return self.shutdown_state.track_work()
+
+    async def reject_if_draining(self, interaction: discord.Interaction):
+        "Answer an interaction received while shutting down, and return whether it was rejected"
+        if not self.shutdown_state.draining:
+            return False
+        await interaction.response.send_message("I'm restarting, please try again in a few seconds!", ephemeral=True)
+        return True
+
+    async def drain(self, timeout: float) -> list[str]:
+        """Stop accepting new component interactions, then wait for the ongoing ones and the buffered database writes,
+        within a deadline
+        Return a report of what was done"""
+        self.shutdown_state.draining = True
+        deadline = time.monotonic() + timeout
+        report: list[str] = []
+        ongoing_count = self.shutdown_state.ongoing_work
+        await self.shutdown_state.wait_for_ongoing_work(timeout)
+        finished_count = ongoing_count - self.shutdown_state.ongoing_work
+        report.append(f"{finished_count}/{ongoing_count} ongoing interactions and jobs finished")
+        for cog in self.cogs.values():
+            if (cog_drain := getattr(cog, "cog_drain", None)) is not None:
+                report.append(await cog_drain())
+        try:
+            flushed_count = await asyncio.wait_for(self.fb.flush_writes(), max(deadline - time.monotonic(), 0.1))
+        except asyncio.TimeoutError:
+            self.log.warning("Timed out while flushing the database writes")
+            flushed_count = 0
+        report.append(f"{flushed_count} queued participants written, {len(self.fb.pending_participants)} left")
+        for line in report:
+            self.log.info("Drain: %s", line)
+        return report
+
+    def add_stateless_paginator(self, paginator: "StatelessPaginator"):
+        "Register a stateless paginator, so it can receive clicks on its buttons"
+        self.stateless_paginators[paginator.name] = paginator
+
+    def remove_stateless_paginator(self, name: str):
+        "Unregister a stateless paginator"
+        self.stateless_paginators.pop(name, None)
+
     async def on_app_cmd_error(self, interaction: discord.Interaction, error: discord.app_commands.AppCommandError):
         "Dispatch a custom 'interaction_error' when an app command raises an error"
         self.dispatch("interaction_error", interaction, error)
 
     async def fetch_app_commands(self):
         "Populate the app_commands_list attribute from the Discord API"
-        self.app_commands_list = await self.tree.fetch_commands(guild=None)
+        self._set_app_commands(await self.tree.fetch_commands(guild=None))
+
+    def _set_app_commands(self, commands_list: list[discord.app_commands.AppCommand]):
+        "Set the registered app commands, and index them by name"
+        self.app_commands_list = commands_list
+        self.app_commands_by_name = {command.name: command for command in commands_list}
 
     async def fetch_app_command_by_name(self, name: str) -> Optional[discord.app_commands.AppCommand]:
         "Get a specific app command from the Discord API"
         if self.app_commands_list is None:
             await self.fetch_app_commands()
-        if self.app_commands_list is None:
-            raise RuntimeError("app_commands_list is still None after fetching commands")
-        for command in self.app_commands_list:
-            if command.name == name:
-                return command
-        return None
+        return self.app_commands_by_name.get(name)
+
+    def compute_app_commands_hash(self) -> str:
+        "Compute a stable hash of the global app commands defined locally"
+        payloads = sorted(
+            (command.to_dict() for command in self.tree.get_commands(guild=None)),
+            key=lambda payload: (payload.get("type", 1), payload["name"])
+        )
+        return hashlib.sha256(json.dumps(payloads, sort_keys=True).encode()).hexdigest()
+
+    @property
+    def app_commands_hash_file(self):
+        "File storing the hash of the last synced local command tree, to avoid syncing it again if nothing changed"
+        return "app_commands_hash_beta.txt" if self.beta else "app_commands_hash.txt"
+
+    def _read_app_commands_hash(self) -> Optional[str]:
+        "Read the hash of the last synced command tree, if any"
+        try:
+            with open(self.app_commands_hash_file, "r", encoding="utf-8") as file:
+                return file.read().strip()
+        except FileNotFoundError:
+            return None
+
+    async def sync_app_commands(self, force: bool=False) -> Optional[list[discord.app_commands.AppCommand]]:
+        """Sync the global app commands with Discord, unless they didn't change since the last sync
+        Return the synced commands, or None if the sync was skipped"""
+        tree_hash = self.compute_app_commands_hash()
+        if not force and tree_hash == self._read_app_commands_hash():
+            self.log.info("App commands didn't change since the last sync, skipping it")
+            return None
+        commands_list = await self.tree.sync()
+        self._set_app_commands(commands_list)
+        with open(self.app_commands_hash_file, "w", encoding="utf-8") as file:
+            file.write(tree_hash)
+        self.log.info("%s global app commands synced", len(commands_list))
+        return commands_list
 
     async def get_command_mention(self, command_name: str):
         "Get how a command should be mentionned (either app-command mention or raw name)"
@@ -1,10 +1,24 @@
 import json
-from typing import Literal, TypedDict, overload
+from typing import Any, Literal, TypedDict, overload
 
 import discord
 
 
-class _ConfigType(TypedDict):
+class _OptionalConfigType(TypedDict, total=False):
+    FIREBASE_GUILD_INDEX: bool
+    FIREBASE_PAGE_SIZE: int
+    GIVEAWAYS_ARCHIVE_AFTER_DAYS: int
+    FIREBASE_PACKED_PARTICIPANTS: bool
+    FIREBASE_ASYNC_CLIENT: bool
+    GIVEAWAYS_JOIN_RATE: float
+    GIVEAWAYS_JOIN_BURST: int
+    TIME_WARP_SPEED: float
+    CACHE_RECONCILE_MINUTES: int
+    STORAGE_BACKEND: str
+    SQLITE_DATABASE_PATH: str
+
+
+class _ConfigType(_OptionalConfigType):
     DISCORD_RELEASE_TOKEN: str
     DISCORD_BETA_TOKEN: str
     MAIN_GUILD_ID: int
@@ -47,19 +61,61 @@ class Config:
     @overload
     def __getitem__(self, key: Literal["DONATION_URL"]) -> str: ...
 
+    @overload
+    def __getitem__(self, key: Literal["FIREBASE_GUILD_INDEX"]) -> bool: ...
+
+    @overload
+    def __getitem__(self, key: Literal["FIREBASE_PAGE_SIZE"]) -> int: ...
+
+    @overload
+    def __getitem__(self, key: Literal["GIVEAWAYS_ARCHIVE_AFTER_DAYS"]) -> int: ...
+
+    @overload
+    def __getitem__(self, key: Literal["FIREBASE_PACKED_PARTICIPANTS"]) -> bool: ...
+
+    @overload
+    def __getitem__(self, key: Literal["FIREBASE_ASYNC_CLIENT"]) -> bool: ...
+
+    @overload
+    def __getitem__(self, key: Literal["GIVEAWAYS_JOIN_RATE"]) -> float: ...
+
+    @overload
+    def __getitem__(self, key: Literal["GIVEAWAYS_JOIN_BURST"]) -> int: ...
+
+    @overload
+    def __getitem__(self, key: Literal["TIME_WARP_SPEED"]) -> float: ...
+
+    @overload
+    def __getitem__(self, key: Literal["CACHE_RECONCILE_MINUTES"]) -> int: ...
+
+    @overload
+    def __getitem__(self, key: Literal["STORAGE_BACKEND"]) -> str: ...
+
+    @overload
+    def __getitem__(self, key: Literal["SQLITE_DATABASE_PATH"]) -> str: ...
+
     def __getitem__(self, key: str):
         return self.data[key]
 
+    def get(self, key: str, default: Any=None) -> Any:
+        "Get an optional config value, or a default value if it's not set"
+        return self.data.get(key, default)
+
     def check_integrity(self):
         "Check if the loaded config is valid (ie. respects the typing class)"
         if not isinstance(self.data, dict):
             raise TypeError("config.json is not a dict")
         for key in _ConfigType.__annotations__: # pylint: disable=no-member
             if key not in self.data:
+                if key in _ConfigType.__optional_keys__: # pylint: disable=no-member,unsupported-membership-test
+                    continue
                 raise KeyError(f"config.json is missing key {key}")
             annotation_value = _ConfigType.__annotations__[key] # pylint: disable=no-member
             if hasattr(annotation_value, "__origin__"):
                 annotation_value = annotation_value.__origin__
+            if annotation_value is float and type(self.data[key]) is int: # pylint: disable=unidiomatic-typecheck
+                # JSON numbers without a decimal part are loaded as ints (but booleans are not numbers)
+                self.data[key] = float(self.data[key]) # type: ignore
             if not isinstance(self.data[key], annotation_value):
                 raise TypeError(
                     f"config.json key {key} is not of type {annotation_value}")
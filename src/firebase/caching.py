@@ -1,20 +1,32 @@
-from typing import Optional
+from bisect import bisect_left, insort
+from datetime import datetime
+from typing import Any, Iterable, Optional, Union
 
-import discord
-
-from src.modules.giveaways.types import GiveawayData
+from src.modules.giveaways.types import GiveawayData, GiveawayRecord
+from src.utils.clock import Clock
 
 
 class FirebaseCacheControler:
     """Controls the cache for the Firebase requests"""
 
-    def __init__(self):
+    def __init__(self, clock: Optional[Clock]=None):
+        self.clock = clock or Clock()
         self.participants_cache: dict[str, list[int]] = {}
         self.__synced_participants_giveaways: set[str] = set()
-        self.giveaways_cache: dict[str, GiveawayData] = {}
+        self.giveaways_cache: dict[str, GiveawayRecord] = {}
         self.__are_giveaways_sync = False
         self.__are_active_giveaways_sync = False
+        self.__synced_guilds: set[int] = set()
+        # archived giveaways are only read on demand, and are kept out of the indexes
+        self.archived_giveaways_cache: dict[str, GiveawayRecord] = {}
+        self.__synced_archived_guilds: set[int] = set()
         self.event_start_timestamp: Optional[int] = None
+        # secondary indexes, kept in sync with giveaways_cache
+        # only active giveaways are sorted by end date, so ended ones never need their date to be parsed
+        self._guild_index: dict[int, set[str]] = {}
+        self._state_index: dict[bool, set[str]] = {False: set(), True: set()}
+        self._active_ends_at_index: list[tuple[datetime, str]] = []
+        self._indexed_state: dict[str, tuple[bool, Optional[datetime]]] = {}
 
     def are_participants_sync(self, giveaway_id: str):
         "Are the participants cached?"
@@ -30,6 +42,10 @@ class FirebaseCacheControler:
         "Are the active giveaways cached?"
         return self.__are_active_giveaways_sync or self.__are_giveaways_sync
 
+    def are_guild_giveaways_sync(self, guild_id: int):
+        "Are the giveaways of a guild cached?"
+        return self.__are_giveaways_sync or guild_id in self.__synced_guilds
+
     def get_participants(self, giveaway_id: str):
         "Get the participants for a giveaway"
         return self.participants_cache.get(giveaway_id)
@@ -38,18 +54,55 @@ class FirebaseCacheControler:
         "Get a giveaway"
         return self.giveaways_cache.get(giveaway_id)
 
+    def get_archived_giveaway(self, giveaway_id: str):
+        "Get an archived giveaway"
+        return self.archived_giveaways_cache.get(giveaway_id)
+
+    def get_archived_guild_giveaways(self, guild_id: int) -> Optional[list[GiveawayRecord]]:
+        "Get the archived giveaways of a guild, or None if they're not cached"
+        if guild_id not in self.__synced_archived_guilds:
+            return None
+        return [gaw for gaw in self.archived_giveaways_cache.values() if gaw.guild == guild_id]
+
+    def is_archived(self, giveaway_id: str):
+        "Is the giveaway known to be archived?"
+        return giveaway_id in self.archived_giveaways_cache
+
     def get_giveaways(self):
         "Get all giveaways"
         return self.giveaways_cache.values()
 
     def get_active_giveaways(self):
         "Get all active giveaways"
-        return filter(lambda g: not g["ended"], self.giveaways_cache.values())
+        return (self.giveaways_cache[gaw_id] for gaw_id in self._state_index[False])
 
     def get_pending_giveaways(self):
         "Get all active giveaways whose end date is in the past"
-        now = discord.utils.utcnow()
-        return filter(lambda g: not g["ended"] and g["ends_at"] < now, self.giveaways_cache.values())
+        return self.query_giveaways(ended=False, ends_before=self.clock.now())
+
+    def query_giveaways(self, guild_id: Optional[int]=None, ended: Optional[bool]=None,
+                        ends_before: Optional[datetime]=None, sort: bool=True) -> list[GiveawayRecord]:
+        """Get the giveaways matching the given filters, sorted by end date
+        End dates are not parsed if 'sort' is False and 'ends_before' is None"""
+        if guild_id is None and ended is False:
+            # already sorted by end date
+            bound = self._ends_at_bound(ends_before)
+            return [self.giveaways_cache[gaw_id] for _, gaw_id in self._active_ends_at_index[:bound]]
+        if guild_id is not None:
+            # a guild usually has few giveaways, so filter its own ids
+            ids = self._guild_index.get(guild_id, set())
+            if ended is not None:
+                ids = ids & self._state_index[ended]
+        elif ended is None:
+            ids = self.giveaways_cache.keys()
+        else:
+            ids = self._state_index[ended]
+        giveaways = [self.giveaways_cache[gaw_id] for gaw_id in ids]
+        if ends_before is not None:
+            giveaways = [gaw for gaw in giveaways if gaw.ends_at < ends_before]
+        if sort:
+            giveaways.sort(key=lambda gaw: gaw.ends_at)
+        return giveaways
 
     def set_participants(self, giveaway_id: str, participants: list[int]):
         "Set the participants for all giveaways"
@@ -57,45 +110,183 @@ class FirebaseCacheControler:
         self.__synced_participants_giveaways.add(giveaway_id)
 
     def add_participant(self, giveaway_id: str, participant: int):
-        "Add a participant to a giveaway, if the full list is already cached"
-        if (participants := self.participants_cache.get(giveaway_id)) is not None:
+        "Add a participant to a giveaway, if the full list is already cached and they're not in it yet"
+        if (participants := self.participants_cache.get(giveaway_id)) is not None and participant not in participants:
             participants.append(participant)
 
-    def set_giveaways(self, giveaways: list[GiveawayData]):
+    def remove_participant(self, giveaway_id: str, participant: int):
+        "Remove a participant from a giveaway, if the full list is already cached"
+        if (participants := self.participants_cache.get(giveaway_id)) is not None and participant in participants:
+            participants.remove(participant)
+
+    def set_giveaways(self, giveaways: list[GiveawayRecord]):
         "Set the giveaways"
-        self.giveaways_cache = {g["id"]: g for g in giveaways}
+        self.giveaways_cache = {g.id: g for g in giveaways}
+        self._rebuild_indexes(giveaways)
+        self.__are_giveaways_sync = True
+
+    def merge_giveaways(self, giveaways: list[GiveawayRecord], previous_ids: Iterable[str]):
+        """Set the giveaways read from the whole node in several requests, 'previous_ids' being the cached ones before
+        the first request
+        Only those are dropped if they were not read, so giveaways created during the read are kept"""
+        read_ids = {gaw.id for gaw in giveaways}
+        for gaw_id in previous_ids:
+            if gaw_id not in read_ids:
+                self.delete_giveaway(gaw_id)
+        for gaw in giveaways:
+            self.set_existing_giveaway(gaw)
         self.__are_giveaways_sync = True
 
-    def set_active_giveaways(self, giveaways: list[GiveawayData]):
+    def set_active_giveaways(self, giveaways: list[GiveawayRecord]):
         "Set the active giveaways"
-        self.giveaways_cache = {g["id"]: g for g in giveaways}
+        self.giveaways_cache = {g.id: g for g in giveaways}
+        self._rebuild_indexes(giveaways)
         self.__are_active_giveaways_sync = True
+        self.__synced_guilds.clear()
 
-    def set_new_giveaway(self, giveaway: GiveawayData):
+    def set_guild_giveaways(self, guild_id: int, giveaways: list[GiveawayRecord]):
+        "Set the giveaways of a guild"
+        for gaw in giveaways:
+            self.set_existing_giveaway(gaw)
+        self.__synced_guilds.add(guild_id)
+
+    def set_new_giveaway(self, giveaway: GiveawayRecord):
         "Set a new giveaway"
-        self.giveaways_cache[giveaway["id"]] = giveaway
-        self.participants_cache[giveaway["id"]] = []
-        self.__synced_participants_giveaways.add(giveaway["id"])
+        self.giveaways_cache[giveaway.id] = giveaway
+        self._index_giveaway(giveaway)
+        self.participants_cache[giveaway.id] = []
+        self.__synced_participants_giveaways.add(giveaway.id)
 
-    def set_existing_giveaway(self, giveaway: GiveawayData):
+    def set_existing_giveaway(self, giveaway: GiveawayRecord):
         "Set an existing giveaway"
-        self.giveaways_cache[giveaway["id"]] = giveaway
+        self.giveaways_cache[giveaway.id] = giveaway
+        self._index_giveaway(giveaway)
 
-    def edit_giveaway(self, giveaway_id: str, partial_giveaway: GiveawayData):
+    def edit_giveaway(self, giveaway_id: str, partial_giveaway: Union[GiveawayData, GiveawayRecord]):
         "Edit a giveaway"
         if giveaway_id in self.giveaways_cache:
-            self.giveaways_cache[giveaway_id].update(partial_giveaway)
+            if partial_giveaway is not self.giveaways_cache[giveaway_id]:
+                self.giveaways_cache[giveaway_id].update(partial_giveaway)
+            self._index_giveaway(self.giveaways_cache[giveaway_id])
+
+    def set_archived_giveaway(self, giveaway: GiveawayRecord):
+        "Set an archived giveaway"
+        self.archived_giveaways_cache[giveaway.id] = giveaway
+
+    def set_archived_guild_giveaways(self, guild_id: int, giveaways: list[GiveawayRecord]):
+        "Set the archived giveaways of a guild"
+        for gaw in giveaways:
+            self.archived_giveaways_cache[gaw.id] = gaw
+        self.__synced_archived_guilds.add(guild_id)
+
+    def archive_giveaway(self, giveaway_id: str):
+        "Move a giveaway out of the hot cache, and forget its participants"
+        if (gaw := self.giveaways_cache.get(giveaway_id)) is None:
+            return
+        self._unindex_giveaway(gaw)
+        del self.giveaways_cache[giveaway_id]
+        self.archived_giveaways_cache[giveaway_id] = gaw
+        if giveaway_id in self.participants_cache:
+            del self.participants_cache[giveaway_id]
+            self.__synced_participants_giveaways.remove(giveaway_id)
 
     def close_giveaway(self, giveaway_id: str, winners: list[int]):
         "Close a giveaway"
+        if gaw := self.archived_giveaways_cache.get(giveaway_id):
+            gaw.ended = True
+            gaw.winners = winners
         if giveaway_id in self.giveaways_cache:
-            self.giveaways_cache[giveaway_id]["ended"] = True
-            self.giveaways_cache[giveaway_id]["winners"] = winners
+            self.giveaways_cache[giveaway_id].ended = True
+            self.giveaways_cache[giveaway_id].winners = winners
+            self._index_giveaway(self.giveaways_cache[giveaway_id])
 
     def delete_giveaway(self, giveaway_id: str):
         "Delete a giveaway"
+        self.archived_giveaways_cache.pop(giveaway_id, None)
         if giveaway_id in self.giveaways_cache:
+            self._unindex_giveaway(self.giveaways_cache[giveaway_id])
             del self.giveaways_cache[giveaway_id]
         if giveaway_id in self.participants_cache:
             del self.participants_cache[giveaway_id]
             self.__synced_participants_giveaways.remove(giveaway_id)
+
+    def to_snapshot(self) -> dict[str, Any]:
+        "Export the giveaways and participants cache as a JSON-serializable dict, to be loaded after a restart"
+        return {
+            "giveaways": {gaw_id: gaw.to_raw() for gaw_id, gaw in self.giveaways_cache.items()},
+            "participants": {
+                gaw_id: self.participants_cache[gaw_id]
+                for gaw_id in self.__synced_participants_giveaways
+                if gaw_id in self.participants_cache
+            },
+            "giveaways_sync": self.__are_giveaways_sync,
+            "active_giveaways_sync": self.__are_active_giveaways_sync,
+            "synced_guilds": list(self.__synced_guilds),
+        }
+
+    def load_snapshot(self, snapshot: dict[str, Any]):
+        "Replace the giveaways and participants cache with a snapshot exported by to_snapshot"
+        giveaways = [GiveawayRecord.from_raw(gaw_id, raw) for gaw_id, raw in snapshot["giveaways"].items()]
+        self.giveaways_cache = {gaw.id: gaw for gaw in giveaways}
+        self._rebuild_indexes(giveaways)
+        self.__are_giveaways_sync = snapshot["giveaways_sync"]
+        self.__are_active_giveaways_sync = snapshot["active_giveaways_sync"]
+        self.__synced_guilds = set(snapshot["synced_guilds"])
+        for gaw_id, participants in snapshot["participants"].items():
+            self.set_participants(gaw_id, participants)
+
+    def _ends_at_bound(self, ends_before: Optional[datetime]):
+        "Get the index of the first active giveaway ending after a given date, in the sorted end dates index"
+        if ends_before is None:
+            return len(self._active_ends_at_index)
+        return bisect_left(self._active_ends_at_index, (ends_before, ""))
+
+    def _index_giveaway(self, giveaway: GiveawayRecord):
+        """Add a giveaway to the secondary indexes, or move it if its state or end date changed
+        The previously indexed values are used for removal, as cached records may be edited in place"""
+        gaw_id = giveaway.id
+        new_state = (giveaway.ended, None if giveaway.ended else giveaway.ends_at)
+        if (old_state := self._indexed_state.get(gaw_id)) == new_state:
+            return
+        if old_state is not None:
+            self._state_index[old_state[0]].discard(gaw_id)
+            self._remove_from_ends_at_index(gaw_id, old_state[1])
+        self._guild_index.setdefault(giveaway.guild, set()).add(gaw_id)
+        self._state_index[giveaway.ended].add(gaw_id)
+        if new_state[1] is not None:
+            insort(self._active_ends_at_index, (new_state[1], gaw_id))
+        self._indexed_state[gaw_id] = new_state
+
+    def _unindex_giveaway(self, giveaway: GiveawayRecord):
+        "Remove a giveaway from the secondary indexes"
+        gaw_id = giveaway.id
+        if (old_state := self._indexed_state.pop(gaw_id, None)) is None:
+            return
+        if guild_ids := self._guild_index.get(giveaway.guild):
+            guild_ids.discard(gaw_id)
+            if not guild_ids:
+                del self._guild_index[giveaway.guild]
+        self._state_index[old_state[0]].discard(gaw_id)
+        self._remove_from_ends_at_index(gaw_id, old_state[1])
+
+    def _remove_from_ends_at_index(self, giveaway_id: str, ends_at: Optional[datetime]):
+        "Remove an active giveaway from the sorted end dates index"
+        if ends_at is None:
+            return
+        entries = self._active_ends_at_index
+        position = bisect_left(entries, (ends_at, giveaway_id))
+        if position < len(entries) and entries[position][1] == giveaway_id:
+            del entries[position]
+
+    def _rebuild_indexes(self, giveaways: Iterable[GiveawayRecord]):
+        "Rebuild every secondary index from scratch"
+        self._guild_index = {}
+        self._state_index = {False: set(), True: set()}
+        self._indexed_state = {}
+        for gaw in giveaways:
+            self._guild_index.setdefault(gaw.guild, set()).add(gaw.id)
+            self._state_index[gaw.ended].add(gaw.id)
+            self._indexed_state[gaw.id] = (gaw.ended, None if gaw.ended else gaw.ends_at)
+        self._active_ends_at_index = sorted(
+            (ends_at, gaw_id) for gaw_id, (_, ends_at) in self._indexed_state.items() if ends_at is not None
+        )
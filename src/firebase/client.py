@@ -1,162 +1,855 @@
+import asyncio
+import gzip
+import json
 import logging
+import os
 import time
+import uuid
+from collections import Counter
 from datetime import datetime as dt
-from typing import AsyncGenerator, Literal, Optional
+from datetime import timezone
+from typing import AsyncGenerator, Awaitable, Callable, Hashable, Literal, Optional, TypeVar, Union
 
+import aiohttp
 import firebase_admin
-from firebase_admin import credentials, db
+from firebase_admin import credentials, db, exceptions
 
-from src.firebase.caching import FirebaseCacheControler
+from src.firebase.coalescing import SingleFlight
+from src.firebase.packing import CHUNK_SIZE, PackedChunk, chunk_key, pack_chunk, unpack_chunk, unpack_chunk_ids
 from src.firebase.rc_rest_api import RemoteConfigClient
-from src.modules.giveaways.types import GiveawayData, RawGiveawayData
+from src.firebase.resilience import BackendUnavailableError, CircuitBreaker, backoff_delay
+from src.firebase.rtdb_rest_api import AsyncReference, RealtimeDatabaseClient
+from src.modules.giveaways.types import GiveawayData, GiveawayRecord, RawGiveawayData
+from src.storage.base import GiveawaysStorage
+from src.utils.clock import Clock
 
+# participants used to be stored as 'true', they are now stored with their join date (in ms)
+ParticipantValue = Union[Literal[True], int]
+JOIN_TIMESTAMP_VALUE = {".sv": "timestamp"}
 
-class FirebaseDB:
-    "Firebase client class to access the database"
+# errors that are worth retrying, and that mean the backend is unhealthy
+TRANSIENT_ERRORS = (
+    exceptions.UnavailableError,
+    exceptions.DeadlineExceededError,
+    exceptions.InternalError,
+    exceptions.UnknownError,
+    ConnectionError,
+    TimeoutError,
+    asyncio.TimeoutError,
+    aiohttp.ClientConnectionError,
+    aiohttp.ClientPayloadError,
+)
+T = TypeVar("T")
 
-    def __init__(self, config_filename: str, realtime_url: str):
+def _parse_join_timestamp(value: ParticipantValue) -> Optional[dt]:
+    "Get the join date of a participant from its database value"
+    if value is True or not isinstance(value, (int, float)):
+        return None
+    return dt.fromtimestamp(value / 1000, tz=timezone.utc)
+
+def _fingerprint(raw: Optional[RawGiveawayData]) -> Optional[dict]:
+    """Get a comparable version of a giveaway document, without the empty fields the database doesn't store, nor
+    the 'id' field that older documents contain, nor the claim token of their last closing"""
+    if raw is None:
+        return None
+    return {
+        key: value for key, value in raw.items()
+        if value is not None and value != [] and key not in ("id", "closed_by")
+    }
+
+def _join_timestamp_ms(value: ParticipantValue) -> Optional[int]:
+    "Get the join timestamp (in ms) of a participant from its database value"
+    if value is True or not isinstance(value, (int, float)):
+        return None
+    return int(value)
+
+
+class FirebaseDB(GiveawaysStorage):
+    """Firebase client class to access the database
+    Every database call goes through a circuit breaker: while the backend is failing, reads are served from the
+    (possibly stale) cache and new participants are queued, to be written once the backend is back
+
+    If 'packed_participants' is enabled, participants are still added one key per user, and are then regularly moved
+    into chunks of packed IDs under 'giveaways_participants_packed', which are much faster to download and parse
+
+    If 'async_client' is enabled, the database is accessed through its REST API with aiohttp instead of the blocking
+    firebase_admin SDK, so requests don't need a worker thread each and can all run concurrently"""
+
+    RETRIES = 2
+    # maximum number of giveaway documents fetched at once when reading the guild index
+    INDEX_CONCURRENCY = 10
+
+    def __init__(self, config_filename: str, realtime_url: str, guild_index: bool=False, page_size: int=100,
+                 packed_participants: bool=False, async_client: bool=False, clock: Optional[Clock]=None):
+        super().__init__(clock)
         cred = credentials.Certificate(config_filename)
         self.app = firebase_admin.initialize_app(cred, {
             'databaseURL': realtime_url,
+            'httpTimeout': 10,
         })
         self.rc = RemoteConfigClient(cred)
-        self.cache = FirebaseCacheControler()
+        self.rest = RealtimeDatabaseClient(cred, realtime_url) if async_client else None
         self.log = logging.getLogger("cobot.firebase")
+        # whether to maintain and use the 'guild_giveaways/{guild}' index node
+        self.guild_index = guild_index
+        # number of documents fetched per request when iterating over a whole node
+        self.page_size = page_size
+        self.packed_participants = packed_participants
+        # number of participants of each giveaway that are not packed yet, when known
+        self._unpacked_counts: dict[str, int] = {}
+        self._packing_locks: dict[str, asyncio.Lock] = {}
+        self._background_tasks: set[asyncio.Task] = set()
+        # ETags of the giveaway documents checked by the reconciler, by path
+        self._reconciled_etags: dict[str, str] = {}
+        self.breaker = CircuitBreaker()
+        # concurrent cache misses on the same node share a single request
+        self.flights = SingleFlight()
+        self._replay_task: Optional[asyncio.Task] = None
+
+    def _reference(self, path: str="/") -> Union[db.Reference, AsyncReference]:
+        "Get a reference to a database location, from the REST client if enabled or from the SDK otherwise"
+        if self.rest is not None:
+            return self.rest.reference(path)
+        return db.reference(path)
 
-    async def get_giveaways(self) -> AsyncGenerator[GiveawayData, None]:
-        "Get a generator of giveaway documents"
+    async def close(self):
+        "Close the connections to the database"
+        if self.rest is not None:
+            await self.rest.close()
+
+    async def _call(self, func: Callable[..., T], *args, **kwargs) -> T:
+        """Run a database call (in a worker thread if it's a blocking SDK call), retrying transient errors with a jittered exponential
+        backoff, and keeping track of the backend health
+        Raise BackendUnavailableError if the circuit breaker is open, or if every attempt failed"""
+        for attempt in range(self.RETRIES + 1):
+            if not self.breaker.allow_request():
+                raise BackendUnavailableError("Circuit breaker is open")
+            start = time.monotonic()
+            try:
+                if asyncio.iscoroutinefunction(func):
+                    result = await func(*args, **kwargs)
+                else:
+                    result = await asyncio.to_thread(func, *args, **kwargs)
+            except TRANSIENT_ERRORS as err:
+                self.breaker.record_failure(time.monotonic() - start)
+                self.log.warning("Database call failed (attempt %s/%s): %s", attempt + 1, self.RETRIES + 1, err)
+                if attempt == self.RETRIES:
+                    raise BackendUnavailableError(str(err)) from err
+                await asyncio.sleep(backoff_delay(attempt))
+            except Exception:
+                # any other error means the backend answered
+                self.breaker.record_success(time.monotonic() - start)
+                raise
+            except BaseException:
+                # cancelled, a half-open trial must not stay in progress forever
+                self.breaker.record_cancelled()
+                raise
+            else:
+                self.breaker.record_success(time.monotonic() - start)
+                if self.pending_participants and self._replay_task is None:
+                    self._replay_task = asyncio.create_task(self.flush_pending_participants())
+                return result
+        raise RuntimeError("unreachable")
+
+    async def flush_pending_participants(self) -> int:
+        """Write the participants queued while the backend was unavailable, and return how many were written
+        They are written in a single multi-path update, and are kept in the queue if it fails"""
+        try:
+            pending, self.pending_participants = self.pending_participants, []
+            if not pending:
+                return 0
+            self.log.info("Replaying %s queued participants", len(pending))
+            try:
+                await self._call(self._reference().update, {
+                    f"giveaways_participants/{giveaway_id}/{user_id}": timestamp
+                    for giveaway_id, user_id, timestamp in pending
+                })
+            except BackendUnavailableError:
+                self.pending_participants = pending + self.pending_participants
+                return 0
+            except asyncio.CancelledError:
+                # keep them for the cache snapshot if we're shutting down
+                self.pending_participants = pending + self.pending_participants
+                raise
+            return len(pending)
+        finally:
+            self._replay_task = None
+
+    def save_cache_snapshot(self, path: str) -> int:
+        """Write the cache content and the queued participants to a compressed file, to be loaded after a restart
+        Return the size of the written file"""
+        snapshot = {
+            "saved_at": time.time(),
+            "cache": self.cache.to_snapshot(),
+            "pending_participants": self.pending_participants,
+        }
+        with gzip.open(path, "wt", encoding="utf-8") as file:
+            json.dump(snapshot, file)
+        return os.path.getsize(path)
+
+    def load_cache_snapshot(self, path: str, max_age: float) -> bool:
+        """Load a cache snapshot written by save_cache_snapshot, and delete it so it's never loaded twice
+        The cache is only loaded if the snapshot is recent enough, but queued participants are always kept
+        Return whether the cache was loaded"""
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as file:
+                snapshot = json.load(file)
+        except FileNotFoundError:
+            return False
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+        self.pending_participants.extend(
+            (giveaway_id, user_id, timestamp) for giveaway_id, user_id, timestamp in snapshot["pending_participants"]
+        )
+        if (age := time.time() - snapshot["saved_at"]) > max_age:
+            self.log.info("Ignoring cache snapshot saved %ss ago", round(age))
+            return False
+        self.cache.load_snapshot(snapshot["cache"])
+        self.log.info("Cache snapshot loaded: %s giveaways, saved %ss ago", len(self.cache.giveaways_cache), round(age))
+        return True
+
+    async def flush_writes(self) -> int:
+        """Wait for the background writes to finish, and write the queued participants
+        Return the number of queued participants that were written"""
+        if self._background_tasks:
+            await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        return await self.flush_pending_participants()
+
+    async def reconcile_cache(self) -> Counter[str]:
+        """Compare cheap fingerprints of the database with the cache, and fetch again only the entries that drifted
+        - the giveaways node keys (read shallowly), to find giveaways deleted from the database or missing from the cache
+        - the ETag of each active giveaway document, which is only downloaded again if it changed
+        - the ETag of the participants node of each active giveaway whose participants are cached, whose keys are
+          only downloaded and compared if it changed
+        Nothing is checked while the circuit breaker isn't closed
+        Return the number of checked and drifted entries"""
+        stats: Counter[str] = Counter()
+        if self.breaker.state != "closed" or not self.cache.are_active_giveaways_sync:
+            return stats
+        # giveaways added or deleted behind our back
+        # ids are taken before reading, so giveaways created meanwhile aren't considered deleted
+        cached_ids = set(self.cache.giveaways_cache)
+        remote_ids = set(await self._call(self._reference("giveaways").get, shallow=True) or {})
+        for gaw_id in cached_ids - remote_ids:
+            self.cache.delete_giveaway(gaw_id)
+            stats["giveaways_removed"] += 1
         if self.cache.are_giveaways_sync:
-            for gaw in self.cache.get_giveaways():
+            for gaw_id in remote_ids - cached_ids:
+                if await self._fetch_giveaway(gaw_id, include_archived=False) is not None:
+                    stats["giveaways_added"] += 1
+        # active giveaways edited behind our back
+        for gaw in list(self.cache.get_active_giveaways()):
+            path = f"giveaways/{gaw.id}"
+            changed, raw, etag = await self._call(
+                self._reference(path).get_if_changed, self._reconciled_etags.get(path, "")
+            )
+            stats["giveaways_checked"] += 1
+            if not changed:
+                continue
+            self._reconciled_etags[path] = etag
+            if raw is None:
+                self.cache.delete_giveaway(gaw.id)
+                stats["giveaways_removed"] += 1
+            elif _fingerprint(raw) != _fingerprint(gaw.to_raw()):
+                self.log.warning("Giveaway %s drifted from the database, updating the cache", gaw.id)
+                self.cache.edit_giveaway(gaw.id, GiveawayRecord.from_raw(gaw.id, raw))
+                stats["giveaways_drifted"] += 1
+        # participants added or removed behind our back
+        for gaw in list(self.cache.get_active_giveaways()):
+            if not self.cache.are_participants_sync(gaw.id):
+                continue
+            cached_participants = set(self.cache.get_participants(gaw.id) or [])
+            path = self._participants_path(gaw.id)
+            changed, keys, etag = await self._call(
+                self._reference(path).get_if_changed, self._reconciled_etags.get(path, "")
+            )
+            stats["participants_checked"] += 1
+            if not changed:
+                continue
+            self._reconciled_etags[path] = etag
+            remote_participants = {int(user_id) for user_id in keys or {}}
+            missing = remote_participants - cached_participants
+            # packed participants are not listed in this node, and unwritten ones are not there yet
+            extra = set() if self.packed_participants else \
+                cached_participants - remote_participants - set(self._unwritten_participants(gaw.id))
+            if missing or extra:
+                self.log.warning("Participants of giveaway %s drifted from the database (%s missing, %s extra), \
+fetching them again", gaw.id, len(missing), len(extra))
+                await self._fetch_participants(gaw.id)
+                stats["participants_drifted"] += 1
+        self.drift_stats.update(stats)
+        return stats
+
+    async def get_giveaways(self, guild_id: Optional[int]=None) -> AsyncGenerator[GiveawayRecord, None]:
+        """Get a generator of giveaway documents, optionally restricted to a guild
+        Documents are streamed page by page, so stopping the iteration early avoids downloading the rest
+        If the whole node is already being read, the read is awaited and the documents are served from the cache"""
+        if not self.cache.are_giveaways_sync:
+            await self.flights.wait("giveaways")
+        if self.cache.are_giveaways_sync or (guild_id is not None and self.cache.are_guild_giveaways_sync(guild_id)):
+            self.flights.record_hit()
+            for gaw in list(self.cache.get_giveaways()):
+                if guild_id is None or gaw.guild == guild_id:
+                    yield gaw
+            return
+        if guild_id is not None and self.guild_index:
+            async for gaw in self._iter_guild_giveaways(guild_id):
                 yield gaw
             return
-        self.log.debug("Fetching giveaways")
-        ref = db.reference("giveaways")
-        snapshot: dict[str, RawGiveawayData] = ref.get() # type: ignore
-        parsed_giveaways: list[GiveawayData] = [
-            {
-                **gaw, # type: ignore
-                "id": gaw_id,
-                "ends_at": dt.fromisoformat(gaw["ends_at"]),
-                "winners": gaw.get("winners", [])
-            }
-            for gaw_id, gaw in snapshot.items()
-        ]
-        self.cache.set_giveaways(parsed_giveaways)
-        for data in parsed_giveaways:
-            yield data
+        fetched_giveaways: list[GiveawayRecord] = []
+        # giveaways created during the read must not be dropped from the cache at the end
+        previous_ids = list(self.cache.giveaways_cache)
+        try:
+            with self.flights.streaming("giveaways"):
+                async for page in self._iter_giveaways_pages():
+                    fetched_giveaways.extend(page)
+                    for gaw in page:
+                        if guild_id is None or gaw.guild == guild_id:
+                            yield gaw
+        except BackendUnavailableError:
+            self.log.warning("Database unavailable, serving cached giveaways")
+            fetched_ids = {gaw.id for gaw in fetched_giveaways}
+            for gaw in list(self.cache.get_giveaways()):
+                if gaw.id not in fetched_ids and (guild_id is None or gaw.guild == guild_id):
+                    yield gaw
+            return
+        # we only get here if the whole node has been read
+        self.cache.merge_giveaways(fetched_giveaways, previous_ids)
 
-    async def get_active_giveaways(self) -> AsyncGenerator[GiveawayData, None]:
+    async def get_active_giveaways(self) -> AsyncGenerator[GiveawayRecord, None]:
         """Get a generator of active giveaway documents (ie. not 'ended')
+        They are fetched in a single filtered query, as active giveaways are a small subset of the node
         Note: this may include giveaways that have a past end date but have not been marked as ended yet"""
-        if self.cache.are_active_giveaways_sync:
-            for gaw in self.cache.get_active_giveaways():
-                yield gaw
+        for gaw in await self.query_giveaways(ended=False, sort=False):
+            yield gaw
+
+    async def query_giveaways(self, guild_id: Optional[int]=None, ended: Optional[bool]=None,
+                              ends_before: Optional[dt]=None, sort: bool=True) -> list[GiveawayRecord]:
+        """Get the giveaways matching the given filters, sorted by end date unless 'sort' is False
+        Only the active giveaways are fetched from the database if 'ended' is False
+        Cached giveaways are used if the database is unavailable"""
+        try:
+            if ended is False:
+                if not self.cache.are_active_giveaways_sync:
+                    await self._fetch_shared(
+                        "active_giveaways", lambda: self.cache.are_active_giveaways_sync, self._fetch_active_giveaways
+                    )
+            elif guild_id is not None and self.guild_index:
+                if not self.cache.are_guild_giveaways_sync(guild_id):
+                    await self._fetch_shared(
+                        ("guild_giveaways", guild_id), lambda: self.cache.are_guild_giveaways_sync(guild_id),
+                        lambda: self._fetch_guild_giveaways(guild_id)
+                    )
+            elif not self.cache.are_giveaways_sync:
+                await self._fetch_shared("giveaways", lambda: self.cache.are_giveaways_sync, self._fetch_giveaways)
+        except BackendUnavailableError:
+            self.log.warning("Database unavailable, serving cached giveaways")
+        return self.cache.query_giveaways(guild_id=guild_id, ended=ended, ends_before=ends_before, sort=sort)
+
+    async def get_guild_giveaways(self, guild_id: int) -> list[GiveawayRecord]:
+        """Get the giveaway documents of a guild, sorted by end date
+        Only this guild's giveaways are fetched if the guild index is enabled"""
+        if not self.cache.are_guild_giveaways_sync(guild_id):
+            try:
+                if self.guild_index:
+                    await self._fetch_shared(
+                        ("guild_giveaways", guild_id), lambda: self.cache.are_guild_giveaways_sync(guild_id),
+                        lambda: self._fetch_guild_giveaways(guild_id)
+                    )
+                else:
+                    await self._fetch_shared("giveaways", lambda: self.cache.are_giveaways_sync, self._fetch_giveaways)
+            except BackendUnavailableError:
+                self.log.warning("Database unavailable, serving cached giveaways of guild %s", guild_id)
+        return self.cache.query_giveaways(guild_id=guild_id)
+
+    async def _fetch_shared(self, key: Hashable, is_sync: Callable[[], bool], fetch: Callable[[], Awaitable[T]]):
+        """Run a fetch that fills the cache, sharing it with the concurrent fetches of the same key
+        A streamed read of the same node is awaited instead, and the fetch only runs if it stopped before the end"""
+        if await self.flights.wait(key) and is_sync():
             return
+        await self.flights.do(key, fetch)
+
+    async def _fetch_giveaways(self) -> list[GiveawayRecord]:
+        "Fetch every giveaway document from the database and cache them"
+        previous_ids = list(self.cache.giveaways_cache)
+        parsed_giveaways: list[GiveawayRecord] = []
+        async for page in self._iter_giveaways_pages():
+            parsed_giveaways.extend(page)
+        self.cache.merge_giveaways(parsed_giveaways, previous_ids)
+        return parsed_giveaways
+
+    async def _iter_giveaways_pages(self, archived: bool=False) -> AsyncGenerator[list[GiveawayRecord], None]:
+        "Fetch the giveaway (or archived giveaway) documents from the database, by pages of keys ordered documents"
+        path = "archive/giveaways" if archived else "giveaways"
+        self.log.debug("Fetching %s by pages of %s", path, self.page_size)
+        ref = self._reference(path)
+        cursor: Optional[str] = None
+        while True:
+            if cursor is None:
+                query = ref.order_by_key().limit_to_first(self.page_size)
+            else:
+                # start_at is inclusive, so we fetch one more document and skip the cursor
+                query = ref.order_by_key().start_at(cursor).limit_to_first(self.page_size + 1)
+            snapshot: dict[str, RawGiveawayData] = await self._call(query.get) # type: ignore
+            page = [
+                GiveawayRecord.from_raw(gaw_id, gaw)
+                for gaw_id, gaw in (snapshot or {}).items()
+                if gaw_id != cursor
+            ]
+            if not archived:
+                for gaw in page:
+                    self.cache.set_existing_giveaway(gaw)
+            if page:
+                yield page
+            if len(page) < self.page_size:
+                return
+            cursor = page[-1].id
+
+    async def _fetch_active_giveaways(self) -> list[GiveawayRecord]:
+        """Fetch the active giveaway documents from the database in a single filtered query, and cache them
+        Used when the caller needs them all anyway, as active giveaways are a small subset of the node"""
         self.log.debug("Fetching active giveaways")
-        ref = db.reference("giveaways")
-        snapshot: dict[str, RawGiveawayData] = ref.order_by_child("ended").equal_to(False).get() # type: ignore
-        parsed_giveaways: list[GiveawayData] = [
-            {
-                **gaw, # type: ignore
-                "id": gaw_id,
-                "ends_at": dt.fromisoformat(gaw["ends_at"]),
-                "winners": gaw.get("winners", [])
-            }
-            for gaw_id, gaw in snapshot.items()
+        query = self._reference("giveaways").order_by_child("ended").equal_to(False)
+        snapshot: dict[str, RawGiveawayData] = await self._call(query.get) # type: ignore
+        parsed_giveaways = [
+            GiveawayRecord.from_raw(gaw_id, gaw)
+            for gaw_id, gaw in (snapshot or {}).items()
         ]
         self.cache.set_active_giveaways(parsed_giveaways)
-        for data in parsed_giveaways:
-            yield data
+        return parsed_giveaways
+
+    async def _fetch_guild_giveaways(self, guild_id: int) -> list[GiveawayRecord]:
+        "Fetch the giveaway documents of a guild from the guild index and cache them"
+        parsed_giveaways = [gaw async for gaw in self._iter_guild_giveaways(guild_id)]
+        self.cache.set_guild_giveaways(guild_id, parsed_giveaways)
+        return parsed_giveaways
+
+    async def _iter_guild_giveaways(self, guild_id: int) -> AsyncGenerator[GiveawayRecord, None]:
+        """Fetch the giveaway documents of a guild from the guild index
+        Documents are fetched in parallel, with at most INDEX_CONCURRENCY requests at once"""
+        self.log.debug("Fetching giveaways of guild %s", guild_id)
+        ref = self._reference(f"guild_giveaways/{guild_id}")
+        index: Optional[dict[str, Literal[True]]] = await self._call(ref.get, shallow=True) # type: ignore
+        semaphore = asyncio.Semaphore(self.INDEX_CONCURRENCY)
+
+        async def fetch_giveaway(giveaway_id: str):
+            async with semaphore:
+                return await self.get_giveaway(giveaway_id)
+
+        for gaw in await asyncio.gather(*(fetch_giveaway(gaw_id) for gaw_id in (index or {}))):
+            if gaw is not None:
+                yield gaw
+
+    async def backfill_guild_index(self) -> int:
+        "Rebuild the 'guild_giveaways' index node from every existing giveaway, and return the number of indexed giveaways"
+        self.log.info("Backfilling the guild giveaways index")
+        giveaways = await self._fetch_giveaways()
+        ref = self._reference("guild_giveaways")
+        await self._call(ref.set, {
+            str(guild_id): {gaw["id"]: True for gaw in giveaways if gaw["guild"] == guild_id}
+            for guild_id in {gaw["guild"] for gaw in giveaways}
+        })
+        return len(giveaways)
 
-    async def get_giveaway(self, giveaway_id: str) -> Optional[GiveawayData]:
-        "Get a giveaway document"
+    async def get_giveaway(self, giveaway_id: str, include_archived: bool=False) -> Optional[GiveawayRecord]:
+        """Get a giveaway document, optionally looking into the archive if it's not found
+        Raise BackendUnavailableError if the database is unavailable and the giveaway is not cached"""
         if gaw := self.cache.get_giveaway(giveaway_id):
+            self.flights.record_hit()
             return gaw
+        if include_archived and (gaw := self.cache.get_archived_giveaway(giveaway_id)):
+            self.flights.record_hit()
+            return gaw
+        return await self.flights.do(
+            ("giveaway", giveaway_id, include_archived),
+            lambda: self._fetch_giveaway(giveaway_id, include_archived)
+        )
+
+    async def _fetch_giveaway(self, giveaway_id: str, include_archived: bool) -> Optional[GiveawayRecord]:
+        "Fetch a giveaway document and cache it, optionally looking into the archive if it's not found"
         self.log.debug("Fetching giveaway %s", giveaway_id)
-        ref = db.reference(f"giveaways/{giveaway_id}")
-        snapshot: Optional[RawGiveawayData] = ref.get() # type: ignore
+        ref = self._reference(f"giveaways/{giveaway_id}")
+        try:
+            snapshot: Optional[RawGiveawayData] = await self._call(ref.get) # type: ignore
+        except BackendUnavailableError:
+            # None would mean the giveaway doesn't exist, so only a cached document can be served instead
+            if (gaw := self.cache.get_giveaway(giveaway_id)) is None and include_archived:
+                gaw = self.cache.get_archived_giveaway(giveaway_id)
+            if gaw is None:
+                raise
+            self.log.warning("Database unavailable, serving cached giveaway %s", giveaway_id)
+            return gaw
         if snapshot is None:
+            if include_archived:
+                return await self._fetch_archived_giveaway(giveaway_id)
             return None
-        data: GiveawayData = {
-            **snapshot, # type: ignore
-            "id": giveaway_id,
-            "ends_at": dt.fromisoformat(snapshot["ends_at"]),
-            "winners": snapshot.get("winners", [])
-        }
+        data = GiveawayRecord.from_raw(giveaway_id, snapshot)
         self.cache.set_existing_giveaway(data)
         return data
 
+    async def get_archived_giveaways(self, guild_id: int) -> list[GiveawayRecord]:
+        """Get the archived giveaway documents of a guild, sorted by end date
+        The archive is only read the first time a guild's archived giveaways are requested"""
+        if (giveaways := self.cache.get_archived_guild_giveaways(guild_id)) is None:
+            giveaways = []
+            async for page in self._iter_giveaways_pages(archived=True):
+                giveaways.extend(gaw for gaw in page if gaw.guild == guild_id)
+            self.cache.set_archived_guild_giveaways(guild_id, giveaways)
+        return sorted(giveaways, key=lambda gaw: gaw.ends_at)
+
+    async def _fetch_archived_giveaway(self, giveaway_id: str) -> Optional[GiveawayRecord]:
+        "Fetch an archived giveaway document and cache it"
+        self.log.debug("Fetching archived giveaway %s", giveaway_id)
+        ref = self._reference(f"archive/giveaways/{giveaway_id}")
+        snapshot: Optional[RawGiveawayData] = await self._call(ref.get) # type: ignore
+        if snapshot is None:
+            return None
+        data = GiveawayRecord.from_raw(giveaway_id, snapshot)
+        self.cache.set_archived_giveaway(data)
+        return data
+
+    async def archive_giveaways(self, ended_before: dt) -> int:
+        """Move the giveaways that ended before a given date, along with their participants, into the 'archive'
+        subtree, and return the number of archived giveaways"""
+        giveaways = await self.query_giveaways(ended=True, ends_before=ended_before, sort=False)
+        for gaw in giveaways:
+            self.log.info("Archiving giveaway %s", gaw.id)
+            ref = self._reference(f"giveaways_participants/{gaw.id}")
+            participants: Optional[dict[str, ParticipantValue]] = await self._call(ref.get) # type: ignore
+            # move everything in a single atomic update, so a giveaway is never half-archived
+            update = {
+                f"archive/giveaways/{gaw.id}": gaw.to_raw(),
+                f"archive/giveaways_participants/{gaw.id}": participants,
+                f"giveaways/{gaw.id}": None,
+                f"giveaways_participants/{gaw.id}": None,
+            }
+            if self.packed_participants:
+                ref = self._reference(f"giveaways_participants_packed/{gaw.id}")
+                update[f"archive/giveaways_participants_packed/{gaw.id}"] = await self._call(ref.get)
+                update[f"giveaways_participants_packed/{gaw.id}"] = None
+            if self.guild_index:
+                update[f"guild_giveaways/{gaw.guild}/{gaw.id}"] = None
+            await self._call(self._reference().update, update)
+            self.cache.archive_giveaway(gaw.id)
+        return len(giveaways)
+
     async def create_giveaway(self, data: GiveawayData):
         "Create a giveaway document"
         self.log.info("Creating new giveaway %s", data["id"])
-        ref = db.reference("giveaways")
-        ref.child(data["id"]).set({
-            **data,
-            "ends_at": data["ends_at"].isoformat()
-        })
-        self.cache.set_new_giveaway(data)
-
-    async def close_giveaway(self, giveaway_id: str, winners: list[int]):
-        "Mark a giveaway as ended"
-        self.log.info("Marking giveaway %s as ended", giveaway_id)
-        ref = db.reference(f"giveaways/{giveaway_id}")
-        ref.update({
-            "ended": True,
-            "winners": winners
-        })
-        self.cache.close_giveaway(giveaway_id, winners)
+        record = GiveawayRecord.from_data(data)
+        raw_data = record.to_raw()
+        if self.guild_index:
+            # write both the giveaway and its index entry in a single atomic update
+            await self._call(self._reference().update, {
+                f"giveaways/{data['id']}": raw_data,
+                f"guild_giveaways/{data['guild']}/{data['id']}": True,
+            })
+        else:
+            ref = self._reference("giveaways")
+            await self._call(ref.child(data["id"]).set, raw_data)
+        self.cache.set_new_giveaway(record)
+
+    async def claim_giveaway_closing(self, giveaway_id: str,
+                                     previous_winners: Optional[list[int]]=None) -> Optional[str]:
+        """Mark a giveaway as ended with a new claim token, only if it's still active (or, for a reroll, if it still
+        has 'previous_winners'), and return the token if this call claimed it, or None if someone else did
+        The document is compared and replaced with its ETag, and the claim is lost as soon as another token shows up,
+        so only one of several concurrent closings can win"""
+        self.log.info("Claiming the closing of giveaway %s", giveaway_id)
+        claim = uuid.uuid4().hex
+        ref = self._reference(self._giveaway_path(giveaway_id))
+        raw: Optional[RawGiveawayData]
+        raw, etag = await self._call(ref.get, etag=True) # type: ignore
+        initial_claim = None if raw is None else raw.get("closed_by")
+        while True:
+            if raw is None:
+                self.log.info("Giveaway %s doesn't exist anymore, not closing it", giveaway_id)
+                return None
+            current_winners = raw.get("winners", [])
+            # if our own write went through but its response was lost, we did win
+            if raw.get("closed_by") == claim:
+                break
+            if raw.get("closed_by") != initial_claim or (raw["ended"] and (
+                    previous_winners is None or current_winners != previous_winners)):
+                self.log.info("Giveaway %s was already closed by someone else", giveaway_id)
+                if raw["ended"]:
+                    self.cache.close_giveaway(giveaway_id, current_winners)
+                return None
+            written, raw, etag = await self._call( # type: ignore
+                ref.set_if_unchanged, etag, {**raw, "ended": True, "closed_by": claim}
+            )
+            if written:
+                break
+        self.cache.close_giveaway(giveaway_id, current_winners)
+        return claim
+
+    async def close_giveaway(self, giveaway_id: str, claim: str, winners: list[int]) -> bool:
+        """Save the winners of a giveaway claimed with claim_giveaway_closing, and return whether the claim was still
+        held, in which case they were saved"""
+        self.log.info("Saving winners of giveaway %s", giveaway_id)
+        ref = self._reference(self._giveaway_path(giveaway_id))
+        raw: Optional[RawGiveawayData]
+        raw, etag = await self._call(ref.get, etag=True) # type: ignore
+        while True:
+            if raw is None or raw.get("closed_by") != claim:
+                self.log.info("Giveaway %s was claimed by someone else meanwhile, not saving its winners", giveaway_id)
+                return False
+            written, raw, etag = await self._call( # type: ignore
+                ref.set_if_unchanged, etag, {**raw, "winners": winners}
+            )
+            if written:
+                self.cache.close_giveaway(giveaway_id, winners)
+                return True
 
     async def delete_giveaway(self, giveaway_id: str):
         "Delete a giveaway document and its participants"
         self.log.info("Deleting giveaway %s", giveaway_id)
+        if self.cache.is_archived(giveaway_id):
+            await self._call(self._reference().update, {
+                f"archive/giveaways/{giveaway_id}": None,
+                f"archive/giveaways_participants/{giveaway_id}": None,
+                f"archive/giveaways_participants_packed/{giveaway_id}": None,
+            })
+            self.cache.delete_giveaway(giveaway_id)
+            return
+        if self.guild_index and (gaw := await self.get_giveaway(giveaway_id)):
+            # remove the giveaway, its participants and its index entry in a single atomic update
+            await self._call(self._reference().update, {
+                f"giveaways/{giveaway_id}": None,
+                f"giveaways_participants/{giveaway_id}": None,
+                f"giveaways_participants_packed/{giveaway_id}": None,
+                f"guild_giveaways/{gaw['guild']}/{giveaway_id}": None,
+            })
+            self.cache.delete_giveaway(giveaway_id)
+            return
         # remove giveaway entry
-        ref = db.reference(f"giveaways/{giveaway_id}")
-        ref.delete()
+        ref = self._reference(f"giveaways/{giveaway_id}")
+        await self._call(ref.delete)
         # remove participants list
-        ref = db.reference(f"giveaways_participants/{giveaway_id}")
-        ref.delete()
+        ref = self._reference(f"giveaways_participants/{giveaway_id}")
+        await self._call(ref.delete)
+        if self.packed_participants:
+            ref = self._reference(f"giveaways_participants_packed/{giveaway_id}")
+            await self._call(ref.delete)
         # update cache
         self.cache.delete_giveaway(giveaway_id)
 
-    async def edit_giveaway(self, giveaway_id: str, data: GiveawayData):
+    async def edit_giveaway(self, giveaway_id: str, data: GiveawayRecord):
         "Edit a giveaway document"
         self.log.info("Editing giveaway %s", giveaway_id)
-        ref = db.reference(f"giveaways/{giveaway_id}")
-        ref.update({
-            **data,
-            "ends_at": data["ends_at"].isoformat()
-        })
+        ref = self._reference(f"giveaways/{giveaway_id}")
+        await self._call(ref.update, data.to_raw())
         self.cache.edit_giveaway(giveaway_id, data)
 
     async def get_giveaways_participants(self, giveaway_id: str) -> Optional[list[int]]:
-        "Get a list of participants for a giveaway"
+        """Get a list of participants for a giveaway
+        Raise BackendUnavailableError if the database is unavailable and the participants are not cached"""
         if self.cache.are_participants_sync(giveaway_id):
+            self.flights.record_hit()
             return self.cache.get_participants(giveaway_id)
+        return await self.flights.do(("participants", giveaway_id), lambda: self._fetch_participants(giveaway_id))
+
+    async def _fetch_participants(self, giveaway_id: str) -> Optional[list[int]]:
+        "Fetch the participants of a giveaway and cache them"
         self.log.debug("Fetching participants for giveaway %s", giveaway_id)
-        ref = db.reference(f"giveaways_participants/{giveaway_id}")
-        snapshot: Optional[dict[str, Literal[True]]] = ref.get() # type: ignore
-        if snapshot is None:
+        ref = self._reference(self._participants_path(giveaway_id))
+        try:
+            snapshot: Optional[dict[str, ParticipantValue]] = await self._call(ref.get) # type: ignore
+            # read the chunks last, so participants being packed meanwhile are read twice rather than missed
+            chunks = await self._fetch_packed_chunks(giveaway_id) if self.packed_participants else {}
+        except BackendUnavailableError:
+            # None would mean nobody joined, so only a cached list can be served instead
+            if (cached_participants := self.cache.get_participants(giveaway_id)) is None:
+                raise
+            self.log.warning("Database unavailable, serving cached participants of giveaway %s", giveaway_id)
+            return cached_participants
+        if snapshot is None and not chunks:
             return None
-        participants = [int(user_id) for user_id in snapshot.keys()]
+        snapshot = snapshot or {}
+        self._unpacked_counts[giveaway_id] = len(snapshot)
+        participants = [user_id for key in sorted(chunks) for user_id in unpack_chunk_ids(chunks[key])]
+        participants.extend(int(user_id) for user_id in snapshot.keys())
+        if chunks and snapshot:
+            participants = list(dict.fromkeys(participants))
+        # participants queued during an outage or being written are not in the database yet
+        participants.extend(
+            user_id for user_id in self._unwritten_participants(giveaway_id)
+            if str(user_id) not in snapshot
+        )
         self.cache.set_participants(giveaway_id, participants)
         return participants
 
+    def _unwritten_participants(self, giveaway_id: str) -> list[int]:
+        "Get the participants of a giveaway that are cached but not written to the database yet"
+        participants = [
+            user_id for pending_giveaway_id, user_id, _ in self.pending_participants
+            if pending_giveaway_id == giveaway_id
+        ]
+        participants.extend(
+            user_id for reserved_giveaway_id, user_id in self.reserved_participants
+            if reserved_giveaway_id == giveaway_id and user_id not in participants
+        )
+        return participants
+
+    async def iter_giveaway_participants_pages(self, giveaway_id: str
+                                               ) -> AsyncGenerator[list[tuple[int, Optional[dt]]], None]:
+        """Fetch the participants of a giveaway by pages of keys ordered (user ID, join date) tuples
+        The join date is None for participants registered before join dates were recorded
+        Packed participants come first, one page per chunk, in join order"""
+        if self.packed_participants:
+            chunks = await self._fetch_packed_chunks(giveaway_id)
+            for key in sorted(chunks):
+                yield [
+                    (user_id, None if timestamp is None else dt.fromtimestamp(timestamp / 1000, tz=timezone.utc))
+                    for user_id, timestamp in unpack_chunk(chunks[key])
+                ]
+        ref = self._reference(self._participants_path(giveaway_id))
+        cursor: Optional[str] = None
+        while True:
+            if cursor is None:
+                query = ref.order_by_key().limit_to_first(self.page_size)
+            else:
+                # start_at is inclusive, so we fetch one more participant and skip the cursor
+                query = ref.order_by_key().start_at(cursor).limit_to_first(self.page_size + 1)
+            snapshot: Optional[dict[str, ParticipantValue]] = await self._call(query.get) # type: ignore
+            keys = [user_id for user_id in (snapshot or {}) if user_id != cursor]
+            if keys:
+                yield [
+                    (int(user_id), _parse_join_timestamp(snapshot[user_id])) # type: ignore
+                    for user_id in keys
+                ]
+            if len(keys) < self.page_size:
+                return
+            cursor = keys[-1]
+
     async def check_giveaway_participant(self, giveaway_id: str, user_id: int) -> bool:
         "Check if a user is a participant of a giveaway"
         if self.cache.are_participants_sync(giveaway_id):
-            if participants := self.cache.get_participants(giveaway_id):
+            if (participants := self.cache.get_participants(giveaway_id)) is not None:
                 return user_id in participants
+        if any(pending[:2] == (giveaway_id, user_id) for pending in self.pending_participants):
+            return True
+        if self.packed_participants:
+            # the participant may be packed, so we need the whole list anyway
+            return user_id in (await self.get_giveaways_participants(giveaway_id) or [])
         self.log.debug("Fetching participant %s for giveaway %s", user_id, giveaway_id)
-        ref = db.reference(f"giveaways_participants/{giveaway_id}/{user_id}")
-        snapshot: Optional[Literal[True]] = ref.get() # type: ignore
+        ref = self._reference(f"{self._participants_path(giveaway_id)}/{user_id}")
+        try:
+            snapshot: Optional[ParticipantValue] = await self._call(ref.get) # type: ignore
+        except BackendUnavailableError:
+            self.log.warning("Database unavailable, assuming %s didn't join giveaway %s", user_id, giveaway_id)
+            return False
         return snapshot is not None
 
     async def add_giveaway_participant(self, giveaway_id: str, user_id: int):
-        "Add a participant to a giveaway"
+        """Add a participant to a giveaway
+        If the database is unavailable, the participant is queued and will be written once it's back"""
         self.log.debug("Adding participant %s to giveaway %s", user_id, giveaway_id)
-        ref = db.reference(f"giveaways_participants/{giveaway_id}/{user_id}")
-        ref.set(True)
+        # cache it first, so a second click during the write is seen as already joined
         self.cache.add_participant(giveaway_id, user_id)
+        ref = self._reference(f"giveaways_participants/{giveaway_id}/{user_id}")
+        try:
+            await self._call(ref.set, JOIN_TIMESTAMP_VALUE)
+        except BackendUnavailableError:
+            self.log.warning("Database unavailable, queueing participant %s for giveaway %s", user_id, giveaway_id)
+            self.pending_participants.append((giveaway_id, user_id, int(self.clock.time() * 1000)))
+        except BaseException:
+            self.cache.remove_participant(giveaway_id, user_id)
+            raise
+        else:
+            if self.packed_participants and giveaway_id in self._unpacked_counts:
+                self._unpacked_counts[giveaway_id] += 1
+                if self._unpacked_counts[giveaway_id] >= CHUNK_SIZE:
+                    self._unpacked_counts[giveaway_id] = 0
+                    task = asyncio.create_task(self._pack_in_background(giveaway_id))
+                    self._background_tasks.add(task)
+                    task.add_done_callback(self._background_tasks.discard)
+        finally:
+            # written, queued or removed from the cache by now
+            self.reserved_participants.discard((giveaway_id, user_id))
+
+    async def _fetch_packed_chunks(self, giveaway_id: str, archived: Optional[bool]=None) -> dict[str, PackedChunk]:
+        "Fetch the packed participants chunks of a giveaway, by chunk key"
+        ref = self._reference(self._packed_participants_path(giveaway_id, archived))
+        return await self._call(ref.get) or {} # type: ignore
+
+    async def pack_giveaway_participants(self, giveaway_id: str, archived: Optional[bool]=None) -> int:
+        """Move the participants of a giveaway that are stored one key per user into packed chunks, and return how
+        many were moved
+        The last chunk is completed first, and everything is written in a single atomic update"""
+        async with self._packing_locks.setdefault(giveaway_id, asyncio.Lock()):
+            if archived is None:
+                archived = self.cache.is_archived(giveaway_id)
+            packed_path = self._packed_participants_path(giveaway_id, archived)
+            unpacked_path = self._participants_path(giveaway_id, archived)
+            unpacked: Optional[dict[str, ParticipantValue]] = await self._call(
+                self._reference(unpacked_path).get
+            ) # type: ignore
+            if not unpacked:
+                return 0
+            chunk_keys: list[str] = sorted(await self._call(self._reference(packed_path).get, shallow=True) or {})
+            entries: list[tuple[int, Optional[int]]] = []
+            first_index = len(chunk_keys)
+            if chunk_keys:
+                last_chunk: PackedChunk = await self._call(self._reference(f"{packed_path}/{chunk_keys[-1]}").get)
+                if len(last_entries := unpack_chunk(last_chunk)) < CHUNK_SIZE:
+                    entries = last_entries
+                    first_index -= 1
+            packed_ids = {user_id for user_id, _ in entries}
+            new_entries = sorted(
+                ((int(user_id), _join_timestamp_ms(value)) for user_id, value in unpacked.items()),
+                key=lambda entry: entry[1] or 0
+            )
+            entries.extend(entry for entry in new_entries if entry[0] not in packed_ids)
+            update: dict[str, Optional[PackedChunk]] = {
+                f"{packed_path}/{chunk_key(first_index + i // CHUNK_SIZE)}": pack_chunk(entries[i:i + CHUNK_SIZE])
+                for i in range(0, len(entries), CHUNK_SIZE)
+            }
+            update.update({f"{unpacked_path}/{user_id}": None for user_id in unpacked})
+            await self._call(self._reference().update, update)
+            self._unpacked_counts[giveaway_id] = 0
+            self.log.debug("Packed %s participants of giveaway %s", len(unpacked), giveaway_id)
+            return len(unpacked)
+
+    async def _pack_in_background(self, giveaway_id: str):
+        "Pack the participants of a giveaway, logging any error instead of raising it"
+        try:
+            await self.pack_giveaway_participants(giveaway_id)
+        except Exception: # pylint: disable=broad-except
+            self.log.exception("Failed to pack participants of giveaway %s", giveaway_id)
+
+    async def pack_all_participants(self) -> tuple[int, int]:
+        """Migrate the participants of every giveaway, including archived ones, to the packed format
+        Return the number of giveaways and participants that were migrated"""
+        giveaways_count = participants_count = 0
+        giveaway_ids = [(gaw.id, False) async for gaw in self.get_giveaways()]
+        async for page in self._iter_giveaways_pages(archived=True):
+            giveaway_ids.extend((gaw.id, True) for gaw in page)
+        for giveaway_id, archived in giveaway_ids:
+            if count := await self.pack_giveaway_participants(giveaway_id, archived=archived):
+                giveaways_count += 1
+                participants_count += count
+        self.log.info("Packed %s participants of %s giveaways", participants_count, giveaways_count)
+        return giveaways_count, participants_count
+
+    def _giveaway_path(self, giveaway_id: str):
+        "Get the database path of a giveaway document, depending on whether it's archived"
+        if self.cache.is_archived(giveaway_id):
+            return f"archive/giveaways/{giveaway_id}"
+        return f"giveaways/{giveaway_id}"
+
+    def _participants_path(self, giveaway_id: str, archived: Optional[bool]=None):
+        "Get the database path of a giveaway participants list, depending on whether it's archived"
+        if self.cache.is_archived(giveaway_id) if archived is None else archived:
+            return f"archive/giveaways_participants/{giveaway_id}"
+        return f"giveaways_participants/{giveaway_id}"
+
+    def _packed_participants_path(self, giveaway_id: str, archived: Optional[bool]=None):
+        "Get the database path of a giveaway packed participants chunks, depending on whether it's archived"
+        if self.cache.is_archived(giveaway_id) if archived is None else archived:
+            return f"archive/giveaways_participants_packed/{giveaway_id}"
+        return f"giveaways_participants_packed/{giveaway_id}"
 
 
     async def get_event_start_timestamp(self) -> Optional[int]:
@@ -169,15 +862,3 @@ class FirebaseDB:
             return None
         self.cache.event_start_timestamp = int(value)
         return int(value)
-
-    async def check_has_event_started(self) -> bool:
-        "Check if the event has started"
-        ts = await self.get_event_start_timestamp()
-        if ts is None: # start date is none means the event has finished
-            return True
-        return ts < time.time()
-
-    async def check_has_event_finished(self) -> bool:
-        "Check if the event has finished"
-        ts = await self.get_event_start_timestamp()
-        return ts is None # start date is none means the event has finished
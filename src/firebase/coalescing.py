@@ -0,0 +1,62 @@
+import asyncio
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Make concurrent fetches of the same key share a single in-flight request
+    Counters: 'hits' for reads served from the cache, 'fetches' for requests actually sent, and 'coalesced' for reads
+    that waited for another one's request instead of sending their own"""
+
+    def __init__(self):
+        self._in_flight: dict[Hashable, asyncio.Future] = {}
+        self.stats = {"hits": 0, "fetches": 0, "coalesced": 0}
+
+    def record_hit(self):
+        "Record a read served from the cache"
+        self.stats["hits"] += 1
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        """Run a fetch, or wait for the result of the one already running for the same key
+        The fetch runs in its own task, so cancelling one of the waiting readers doesn't cancel it for the others"""
+        if (task := self._in_flight.get(key)) is None:
+            self.stats["fetches"] += 1
+            task = asyncio.ensure_future(func())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done_task: self._on_done(key, done_task))
+        else:
+            self.stats["coalesced"] += 1
+        return await asyncio.shield(task)
+
+    async def wait(self, key: Hashable) -> bool:
+        """Wait for the fetch running for a given key to complete, whatever its outcome
+        Return whether there was one"""
+        if (task := self._in_flight.get(key)) is None:
+            return False
+        self.stats["coalesced"] += 1
+        await asyncio.wait([task])
+        return True
+
+    @contextmanager
+    def streaming(self, key: Hashable):
+        """Mark a streamed fetch as in flight for a given key, until the context is exited
+        Its result can't be shared, but other readers can wait for it with wait() and then read the cache"""
+        self.stats["fetches"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            yield
+        finally:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+            future.set_result(None)
+
+    def _on_done(self, key: Hashable, task: asyncio.Future):
+        "Forget a completed fetch"
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # avoid an 'exception was never retrieved' warning if every reader got cancelled
+        if not task.cancelled():
+            task.exception()
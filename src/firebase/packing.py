@@ -0,0 +1,52 @@
+import base64
+import sys
+from array import array
+from typing import Iterable, Optional, TypedDict
+
+# number of participants stored in each packed chunk
+CHUNK_SIZE = 1000
+
+
+class PackedChunk(TypedDict):
+    "A chunk of packed participants, as stored in the database"
+    ids: str # base64-encoded little-endian 64-bit user IDs
+    joined: str # base64-encoded little-endian 64-bit join timestamps (in ms), 0 if unknown
+
+
+def _pack(values: Iterable[int]) -> str:
+    "Encode 64-bit unsigned integers as a base64 string"
+    packed = array("Q", values)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return base64.b64encode(packed.tobytes()).decode("ascii")
+
+def _unpack(data: str) -> array:
+    "Decode a base64 string of 64-bit unsigned integers"
+    values = array("Q")
+    values.frombytes(base64.b64decode(data))
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+def pack_chunk(participants: list[tuple[int, Optional[int]]]) -> PackedChunk:
+    "Pack a list of (user ID, join timestamp in ms) into a chunk"
+    return {
+        "ids": _pack(user_id for user_id, _ in participants),
+        "joined": _pack(timestamp or 0 for _, timestamp in participants),
+    }
+
+def unpack_chunk(chunk: PackedChunk) -> list[tuple[int, Optional[int]]]:
+    "Unpack a chunk into a list of (user ID, join timestamp in ms, or None if unknown)"
+    return [
+        (user_id, timestamp or None)
+        for user_id, timestamp in zip(_unpack(chunk["ids"]), _unpack(chunk["joined"]))
+    ]
+
+def unpack_chunk_ids(chunk: PackedChunk) -> list[int]:
+    "Unpack the user IDs of a chunk"
+    return _unpack(chunk["ids"]).tolist()
+
+def chunk_key(index: int) -> str:
+    """Get the database key of a chunk from its index
+    Keys are prefixed, as the database would turn an object with integer keys into an array"""
+    return f"c{index:06d}"
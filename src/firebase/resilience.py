@@ -0,0 +1,86 @@
+import random
+import time
+from collections import deque
+from typing import Literal, Optional
+
+CircuitState = Literal["closed", "open", "half-open"]
+
+
+class BackendUnavailableError(Exception):
+    "Raised when a database request can't be made, either because the backend keeps failing or the circuit is open"
+
+
+class CircuitBreaker:
+    """Track the health of a backend, and refuse requests while it's failing
+    The circuit opens when the rate of failed or slow requests among the last ones exceeds a threshold. After a
+    cooldown, a single trial request is let through (half-open state): its success closes the circuit again, its
+    failure re-opens it."""
+
+    def __init__(self, window_size: int=20, min_requests: int=5, failure_rate_threshold: float=0.5,
+                 slow_call_threshold: float=5.0, reset_timeout: float=30.0):
+        # outcomes of the last requests, True meaning failed or slow
+        self._outcomes: deque[bool] = deque(maxlen=window_size)
+        self.min_requests = min_requests
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_threshold = slow_call_threshold
+        self.reset_timeout = reset_timeout
+        self._opened_at: Optional[float] = None
+        self._trial_in_progress = False
+
+    @property
+    def state(self) -> CircuitState:
+        "Current state of the circuit"
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at < self.reset_timeout:
+            return "open"
+        return "half-open"
+
+    @property
+    def failure_rate(self) -> float:
+        "Rate of failed or slow requests among the last ones"
+        if not self._outcomes:
+            return 0.0
+        return sum(self._outcomes) / len(self._outcomes)
+
+    def allow_request(self) -> bool:
+        "Check whether a request can be sent to the backend"
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._trial_in_progress:
+            self._trial_in_progress = True
+            return True
+        return False
+
+    def record_success(self, latency: float):
+        "Record a request that reached the backend, which counts as a failure if it was too slow"
+        if latency > self.slow_call_threshold:
+            self.record_failure(latency)
+            return
+        if self._opened_at is not None:
+            # trial request succeeded, close the circuit with a fresh history
+            self._opened_at = None
+            self._outcomes.clear()
+        self._trial_in_progress = False
+        self._outcomes.append(False)
+
+    def record_cancelled(self):
+        "Forget a request whose outcome is unknown because it was cancelled, so another trial request can be sent"
+        self._trial_in_progress = False
+
+    def record_failure(self, _latency: float):
+        "Record a request that failed, and open the circuit if the failure rate is too high"
+        self._trial_in_progress = False
+        if self._opened_at is not None:
+            # trial request failed, wait for another cooldown
+            self._opened_at = time.monotonic()
+            return
+        self._outcomes.append(True)
+        if len(self._outcomes) >= self.min_requests and self.failure_rate >= self.failure_rate_threshold:
+            self._opened_at = time.monotonic()
+
+
+def backoff_delay(attempt: int, base_delay: float=0.2, max_delay: float=5.0) -> float:
+    "Get the delay before retrying a request, using an exponential backoff with full jitter"
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
@@ -0,0 +1,263 @@
+import asyncio
+import json
+import logging
+import time
+from datetime import timezone
+from typing import Any, Optional, Union
+
+import aiohttp
+from firebase_admin import exceptions
+from firebase_admin.credentials import Certificate
+
+# refresh the access token this many seconds before it expires
+TOKEN_REFRESH_MARGIN = 300
+
+JsonValue = Union[None, bool, int, float, str, list, dict]
+
+
+INT32_MIN, INT32_MAX = -2**31, 2**31 - 1
+
+
+def _key_sort_key(key: str):
+    """Sort keys like the Realtime Database: keys that are 32-bit integers first, numerically, then the others
+    lexicographically, which includes Discord snowflakes
+
+    >>> sorted(["b", "10", "2", "-1"], key=_key_sort_key)
+    ['-1', '2', '10', 'b']
+    >>> sorted(["1000000000000000000", "279568324260528128", "99999999999999999", "5"], key=_key_sort_key)
+    ['5', '1000000000000000000', '279568324260528128', '99999999999999999']
+    """
+    try:
+        value = int(key)
+    except ValueError:
+        return (1, 0, key)
+    if INT32_MIN <= value <= INT32_MAX and str(value) == key:
+        return (0, value, "")
+    return (1, 0, key)
+
+def _value_sort_key(value: JsonValue):
+    "Sort child values like the Realtime Database: null, false, true, numbers, strings, then objects"
+    if value is None:
+        return (0, 0, "")
+    if isinstance(value, bool):
+        return (1, int(value), "")
+    if isinstance(value, (int, float)):
+        return (2, value, "")
+    if isinstance(value, str):
+        return (3, 0, value)
+    return (4, 0, "")
+
+def _raise_for_status(status: int, message: str):
+    "Raise the firebase_admin exception matching an HTTP error status, like the SDK does"
+    if status == 400:
+        raise exceptions.InvalidArgumentError(message)
+    if status in (401, 403):
+        raise exceptions.PermissionDeniedError(message)
+    if status == 404:
+        raise exceptions.NotFoundError(message)
+    if status == 412:
+        raise exceptions.FailedPreconditionError(message)
+    if status == 429:
+        raise exceptions.ResourceExhaustedError(message)
+    if status == 500:
+        raise exceptions.InternalError(message)
+    if status == 503:
+        raise exceptions.UnavailableError(message)
+    if status == 504:
+        raise exceptions.DeadlineExceededError(message)
+    raise exceptions.UnknownError(message)
+
+
+class RealtimeDatabaseClient:
+    """Asynchronous Firebase Realtime Database REST API access
+    Requests share a pool of keep-alive connections, and responses are gzip-compressed"""
+
+    def __init__(self, credentials: Certificate, database_url: str, pool_size: int=20, timeout: float=10):
+        self.credentials = credentials
+        self.database_url = database_url.rstrip("/")
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.log = logging.getLogger("cobot.rtdb_rest_api")
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._access_token: Optional[str] = None
+        self._token_expiry = 0.0
+        self._token_lock = asyncio.Lock()
+
+    @property
+    def session(self):
+        "Get a valid aiohttp client session"
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    async def close(self):
+        "Close the connections pool"
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def get_access_token(self) -> str:
+        "Get the current API access token, refreshing it in a worker thread when it's about to expire"
+        async with self._token_lock:
+            if self._access_token is None or time.time() > self._token_expiry - TOKEN_REFRESH_MARGIN:
+                token_info = await asyncio.to_thread(self.credentials.get_access_token)
+                self._access_token = token_info.access_token
+                # google-auth expiry dates are naive UTC datetimes, which timestamp() would read as local time
+                self._token_expiry = token_info.expiry.replace(tzinfo=timezone.utc).timestamp() \
+                    if token_info.expiry else time.time() + 3600
+            return self._access_token
+
+    def reference(self, path: str="/"):
+        "Get a reference to a database location"
+        return AsyncReference(self, path)
+
+    async def request(self, method: str, path: str, params: Optional[dict[str, str]]=None,
+                      payload: Any=None, headers: Optional[dict[str, str]]=None):
+        "Send a request to the database, and return the decoded response along with its headers"
+        url = f"{self.database_url}/{path.strip('/')}.json"
+        request_headers = {
+            "Authorization": "Bearer " + await self.get_access_token(),
+            "Accept-Encoding": "gzip",
+            **(headers or {}),
+        }
+        data = None if payload is None else json.dumps(payload, separators=(",", ":"))
+        async with self.session.request(method, url, params=params, data=data, headers=request_headers) as resp:
+            body = await resp.read()
+            if resp.status >= 400:
+                try:
+                    message = json.loads(body).get("error", body.decode())
+                except (ValueError, AttributeError):
+                    message = body.decode(errors="replace")
+                _raise_for_status(resp.status, f"{method} /{path.strip('/')}: {message}")
+            return (json.loads(body) if body else None), resp.headers
+
+
+class AsyncReference:
+    "Reference to a database location, with the same interface as firebase_admin.db.Reference but asynchronous"
+
+    def __init__(self, client: RealtimeDatabaseClient, path: str):
+        self._client = client
+        self.path = "/" + path.strip("/")
+
+    @property
+    def key(self):
+        "Last part of the reference path"
+        return self.path.rsplit("/", 1)[-1] or None
+
+    def child(self, path: str):
+        "Get a reference to a child location"
+        return AsyncReference(self._client, f"{self.path}/{path.strip('/')}")
+
+    async def get(self, etag: bool=False, shallow: bool=False):
+        """Get the value at this location
+        If 'shallow' is set, child objects are replaced by True. If 'etag' is set, return a (value, ETag) tuple"""
+        if etag and shallow:
+            raise ValueError("etag and shallow cannot both be set")
+        params = {"shallow": "true"} if shallow else None
+        headers = {"X-Firebase-ETag": "true"} if etag else None
+        value, resp_headers = await self._client.request("GET", self.path, params=params, headers=headers)
+        if etag:
+            return value, resp_headers.get("ETag")
+        return value
+
+    async def get_if_changed(self, etag: str) -> tuple[bool, JsonValue, str]:
+        """Get the value at this location, only if it doesn't match an ETag anymore
+        Return whether it changed, along with the new value (None if it didn't change) and ETag"""
+        value, headers = await self._client.request(
+            "GET", self.path, headers={"X-Firebase-ETag": "true", "if-none-match": etag}
+        )
+        new_etag = headers.get("ETag", etag)
+        if new_etag == etag:
+            return False, None, etag
+        return True, value, new_etag
+
+    async def set(self, value: JsonValue):
+        "Replace the value at this location"
+        await self._client.request("PUT", self.path, params={"print": "silent"}, payload=value)
+
+    async def set_if_unchanged(self, expected_etag: str, value: JsonValue) -> tuple[bool, JsonValue, str]:
+        """Replace the value at this location, only if it still matches an ETag
+        Return whether it was written, along with the current value and ETag"""
+        try:
+            _, headers = await self._client.request("PUT", self.path, payload=value, headers={"if-match": expected_etag})
+        except exceptions.FailedPreconditionError:
+            current, current_etag = await self.get(etag=True)
+            return False, current, current_etag
+        return True, value, headers.get("ETag")
+
+    async def update(self, value: dict[str, JsonValue]):
+        "Update some children of this location, in a single atomic write"
+        if not value:
+            raise ValueError("Value argument must be a non-empty dictionary")
+        await self._client.request("PATCH", self.path, params={"print": "silent"}, payload=value)
+
+    async def delete(self):
+        "Delete the value at this location"
+        await self._client.request("DELETE", self.path)
+
+    def order_by_key(self):
+        "Build a query ordering the children by key"
+        return AsyncQuery(self, "$key")
+
+    def order_by_value(self):
+        "Build a query ordering the children by value"
+        return AsyncQuery(self, "$value")
+
+    def order_by_child(self, path: str):
+        "Build a query ordering the children by the value of one of their own children"
+        return AsyncQuery(self, path)
+
+
+class AsyncQuery:
+    """Query on the children of a database location, with the same interface as firebase_admin.db.Query
+    Results are sorted client-side, as the REST API doesn't keep the order in its JSON response"""
+
+    def __init__(self, ref: AsyncReference, order_by: str):
+        self._ref = ref
+        self._order_by = order_by
+        self._params: dict[str, str] = {"orderBy": json.dumps(order_by)}
+
+    def _set(self, name: str, value: JsonValue):
+        self._params[name] = json.dumps(value)
+        return self
+
+    def start_at(self, value: JsonValue):
+        "Only include children starting at a given value (inclusive)"
+        return self._set("startAt", value)
+
+    def end_at(self, value: JsonValue):
+        "Only include children ending at a given value (inclusive)"
+        return self._set("endAt", value)
+
+    def equal_to(self, value: JsonValue):
+        "Only include children equal to a given value"
+        return self._set("equalTo", value)
+
+    def limit_to_first(self, limit: int):
+        "Only include the first children"
+        return self._set("limitToFirst", limit)
+
+    def limit_to_last(self, limit: int):
+        "Only include the last children"
+        return self._set("limitToLast", limit)
+
+    async def get(self) -> Optional[dict[str, JsonValue]]:
+        "Run the query, and return the matching children in query order"
+        value, _ = await self._ref._client.request("GET", self._ref.path, params=self._params) # pylint: disable=protected-access
+        if not isinstance(value, dict):
+            return value
+        if self._order_by == "$key":
+            keys = sorted(value, key=_key_sort_key)
+        elif self._order_by == "$value":
+            keys = sorted(value, key=lambda key: (_value_sort_key(value[key]), _key_sort_key(key)))
+        else:
+            child_path = self._order_by.strip("/").split("/")
+
+            def child_value(key: str):
+                node = value[key]
+                for part in child_path:
+                    node = node.get(part) if isinstance(node, dict) else None
+                return (_value_sort_key(node), _key_sort_key(key))
+
+            keys = sorted(value, key=child_value)
+        return {key: value[key] for key in keys}
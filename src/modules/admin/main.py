@@ -1,10 +1,12 @@
+import asyncio
 import io
 import logging
 import os
-import sys
 import textwrap
 import time
 import traceback
+import tracemalloc
+from collections import deque
 from contextlib import redirect_stdout
 from typing import Any, Literal, Optional
 
@@ -15,8 +17,13 @@ from git import GitCommandError
 from git.repo import Repo
 
 from src.cobot import CObot, COInteraction
+from src.firebase.client import FirebaseDB
+from src.storage.sqlite import SQLiteStorage
 from src.utils.checks import is_bot_admin
 
+# maximum number of seconds to wait for ongoing work before shutting down
+DRAIN_TIMEOUT = 10
+
 
 def cleanup_code(content: str):
     """Automatically removes code blocks from the code."""
@@ -34,6 +41,8 @@ class AdminCog(commands.Cog):
         self.bot = bot
         self._last_result: Any = None
         self.log = logging.getLogger("cobot.admin")
+        # last two memory snapshots taken, to compare them
+        self._memory_snapshots: deque[tracemalloc.Snapshot] = deque(maxlen=2)
 
     group = discord.app_commands.Group(
         name="admin",
@@ -83,8 +92,14 @@ class AdminCog(commands.Cog):
         "Restart the bot"
         await interaction.response.send_message(content="Reboot in progress...")
         await self.cleanup_workspace()
+        report = await self.bot.drain(DRAIN_TIMEOUT)
+        await interaction.edit_original_response(content="Rebooting...\n" + "\n".join(report))
+        size = self.bot.fb.save_cache_snapshot(self.bot.shutdown_state.cache_snapshot_file)
+        self.log.info("Cache snapshot saved (%s KiB)", size // 1024)
+        # close the gateway connection cleanly, start.py will then restart the process
         self.log.info("Restarting the process")
-        os.execl(sys.executable, sys.executable, *sys.argv)
+        self.bot.shutdown_state.restart_requested = True
+        await self.bot.close()
 
     @group.command(name="shutdown")
     @app_commands.check(is_bot_admin)
@@ -92,21 +107,115 @@ class AdminCog(commands.Cog):
         "Shutdown the whole program"
         await interaction.response.send_message("Cleaning up...")
         await self.cleanup_workspace()
-        await interaction.edit_original_response(content="Shutting down...")
+        report = await self.bot.drain(DRAIN_TIMEOUT)
+        await interaction.edit_original_response(content="Shutting down...\n" + "\n".join(report))
         await self.bot.change_presence(status=discord.Status('offline'))
         self.log.info("Shutting down the process, requested by %s", interaction.user)
         await self.bot.close()
 
     @group.command(name="sync-commands")
     @app_commands.check(is_bot_admin)
-    async def sync_app_commands(self, interaction: COInteraction):
-        "Sync app commands"
+    async def sync_app_commands(self, interaction: COInteraction, force: bool=False):
+        "Sync app commands, if they changed since the last sync or if forced"
+        await interaction.response.defer()
+        cmds = await self.bot.sync_app_commands(force=force)
+        if cmds is None:
+            await interaction.followup.send("App commands didn't change since the last sync, nothing to do!")
+            return
+        await interaction.followup.send(f"{len(cmds)} global commands synced!")
+
+    @group.command(name="backfill-guild-index")
+    @app_commands.check(is_bot_admin)
+    async def backfill_guild_index(self, interaction: COInteraction):
+        "Rebuild the Firebase guild giveaways index from existing giveaways"
+        if not isinstance(self.bot.fb, FirebaseDB):
+            await interaction.response.send_message("The guild index only exists with the Firebase storage!")
+            return
         await interaction.response.defer()
-        cmds = await self.bot.tree.sync()
-        txt = f"{len(cmds)} global commands synced"
+        count = await self.bot.fb.backfill_guild_index()
+        txt = f"{count} giveaways indexed"
         self.log.info(txt)
         await interaction.followup.send(txt + '!')
 
+    @group.command(name="pack-participants")
+    @app_commands.check(is_bot_admin)
+    async def pack_participants(self, interaction: COInteraction):
+        "Migrate the participants of every giveaway to the packed Firebase format"
+        if not isinstance(self.bot.fb, FirebaseDB) or not self.bot.fb.packed_participants:
+            await interaction.response.send_message("The packed participants format is not enabled in the config!")
+            return
+        await interaction.response.defer()
+        giveaways_count, participants_count = await self.bot.fb.pack_all_participants()
+        await interaction.followup.send(f"{participants_count} participants of {giveaways_count} giveaways packed!")
+
+    @group.command(name="set-event-date")
+    @app_commands.check(is_bot_admin)
+    async def set_event_date(self, interaction: COInteraction, timestamp: Optional[int]=None):
+        """Set the event start date of the SQLite storage (as a Unix timestamp), or mark the event as finished
+        With the Firebase storage, the date comes from the 'eventTimestamp' Remote Config parameter"""
+        if not isinstance(self.bot.fb, SQLiteStorage):
+            await interaction.response.send_message("The event date is set in Firebase Remote Config with the \
+Firebase storage!")
+            return
+        await self.bot.fb.set_event_start_timestamp(timestamp)
+        if timestamp is None:
+            txt = "Event marked as finished"
+        else:
+            txt = f"Event start date set to <t:{timestamp}:F>"
+        self.log.info(txt)
+        await interaction.response.send_message(txt + '!')
+
+    @group.command(name="memory-profile")
+    @app_commands.check(is_bot_admin)
+    async def memory_profile(self, interaction: COInteraction, action: Literal["start", "snapshot", "diff", "stop"],
+                             limit: app_commands.Range[int, 1, 500]=50):
+        """Profile memory allocations: start tracing, take snapshots, compare the last two, and stop tracing
+        Tracing slows down every allocation, so it should be stopped once done"""
+        if action == "start":
+            if tracemalloc.is_tracing():
+                await interaction.response.send_message("Memory tracing is already running!")
+                return
+            tracemalloc.start()
+            self.log.info("Memory tracing started")
+            await interaction.response.send_message("Memory tracing started!")
+            return
+        if not tracemalloc.is_tracing():
+            await interaction.response.send_message("Memory tracing is not running!")
+            return
+        if action == "stop":
+            tracemalloc.stop()
+            self._memory_snapshots.clear()
+            self.log.info("Memory tracing stopped")
+            await interaction.response.send_message("Memory tracing stopped!")
+            return
+        await interaction.response.defer()
+        current, peak = tracemalloc.get_traced_memory()
+        header = f"Traced memory: {current/1024**2:.1f}MiB (peak: {peak/1024**2:.1f}MiB)"
+        if action == "snapshot":
+            snapshot = await asyncio.to_thread(self._take_memory_snapshot)
+            self._memory_snapshots.append(snapshot)
+            stats = await asyncio.to_thread(snapshot.statistics, "lineno")
+            title = f"Top {limit} allocations by file and line"
+        else:
+            if len(self._memory_snapshots) < 2:
+                await interaction.followup.send("You need to take two snapshots first!")
+                return
+            old_snapshot, new_snapshot = self._memory_snapshots
+            stats = await asyncio.to_thread(new_snapshot.compare_to, old_snapshot, "lineno")
+            title = f"Top {limit} allocation differences between the last two snapshots, by file and line"
+        report = "\n".join([header, title, ""] + [str(stat) for stat in stats[:limit]])
+        file = discord.File(io.BytesIO(report.encode()), filename=f"memory-{action}-{int(time.time())}.txt")
+        await interaction.followup.send(header, file=file)
+
+    @staticmethod
+    def _take_memory_snapshot():
+        "Take a snapshot of the traced memory allocations, ignoring the import system and tracemalloc itself"
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ))
+
     @group.command(name="change-activity")
     async def change_activity(self, _interaction: COInteraction,
                               activity_type: Literal["play", "watch", "listen", "stream"], *, text: str):
@@ -8,6 +8,7 @@ import discord
 from discord.ext import commands, tasks
 
 from src.cobot import CObot, COInteraction
+from src.firebase.resilience import BackendUnavailableError
 
 AllowedCtx = Union[commands.Context, discord.Message, COInteraction, str]
 
@@ -143,6 +144,11 @@ class ErrorsCog(commands.Cog):
         if isinstance(error, discord.app_commands.CheckFailure):
             await send("Oops, it looks like you're not allowed to use this command. Contact our staff to find out why!", 
                        ephemeral=True)
+        if isinstance(getattr(error, "original", None), BackendUnavailableError):
+            # not a bug, and it would flood the errors channel during an outage
+            self.log.warning("Database unavailable during interaction %s", interaction.id)
+            await send("The database is unavailable right now, please try again in a few minutes!", ephemeral=True)
+            return
         if interaction.guild:
             guild = f"{interaction.guild.name} | {get_channel_name(interaction)}"
         elif interaction.guild_id:
@@ -0,0 +1,27 @@
+import csv
+import gzip
+import io
+from datetime import datetime
+from typing import AsyncIterable, BinaryIO, Collection, Optional
+
+
+async def write_participants_csv(file: BinaryIO, pages: AsyncIterable[list[tuple[int, Optional[datetime]]]],
+                                 winners: Collection[int]) -> int:
+    """Stream pages of participants into a gzip-compressed CSV file, and return the number of written rows
+    Rows are written as soon as each page is received, so only one page is kept in memory at a time"""
+    rows_count = 0
+    winners = set(winners)
+    with gzip.GzipFile(fileobj=file, mode="wb") as gzip_file:
+        text_file = io.TextIOWrapper(gzip_file, encoding="utf-8", newline="")
+        writer = csv.writer(text_file)
+        writer.writerow(("user_id", "joined_at", "winner"))
+        async for page in pages:
+            writer.writerows(
+                (user_id, joined_at.isoformat() if joined_at else "", int(user_id in winners))
+                for user_id, joined_at in page
+            )
+            rows_count += len(page)
+        text_file.flush()
+        # don't let the wrapper close the gzip file, as it's closed by the context manager
+        text_file.detach()
+    return rows_count
@@ -0,0 +1,63 @@
+from array import array
+from typing import Optional
+
+SPARKLINE_CHARS = "▁▂▃▄▅▆▇█"
+
+
+class JoinRateTracker:
+    """Count the joins of a giveaway per minute, over a fixed window of recent minutes
+    Counts are stored in a ring buffer of fixed-size arrays, so memory doesn't grow with the participants count"""
+
+    __slots__ = ("_counts", "_minutes", "total", "peak", "peak_minute")
+
+    def __init__(self, window: int=60):
+        # joins count of each slot, and the minute (since epoch) that slot is currently counting
+        self._counts = array("I", [0]) * window
+        self._minutes = array("q", [-1]) * window
+        self.total = 0
+        self.peak = 0
+        self.peak_minute: Optional[int] = None
+
+    @property
+    def window(self):
+        "Number of minutes kept in the buffer"
+        return len(self._counts)
+
+    def record(self, timestamp: float):
+        "Record a join at a given UNIX timestamp"
+        minute = int(timestamp // 60)
+        slot = minute % self.window
+        if self._minutes[slot] != minute:
+            # this slot was counting an older minute, which is now out of the window
+            self._minutes[slot] = minute
+            self._counts[slot] = 0
+        self._counts[slot] += 1
+        self.total += 1
+        if self._counts[slot] > self.peak:
+            self.peak = self._counts[slot]
+            self.peak_minute = minute
+
+    def count_at(self, minute: int) -> int:
+        "Get the number of joins during a given minute (since epoch), or 0 if it's out of the window"
+        slot = minute % self.window
+        return self._counts[slot] if self._minutes[slot] == minute else 0
+
+    def series(self, now: float, minutes: Optional[int]=None) -> list[int]:
+        "Get the joins count of each of the last minutes, oldest first, the last one being the current minute"
+        minutes = min(minutes or self.window, self.window)
+        current_minute = int(now // 60)
+        return [self.count_at(minute) for minute in range(current_minute - minutes + 1, current_minute + 1)]
+
+    def rate(self, now: float, minutes: int) -> float:
+        "Get the average number of joins per minute over the last minutes"
+        series = self.series(now, minutes)
+        return sum(series) / len(series)
+
+    @staticmethod
+    def sparkline(series: list[int]) -> str:
+        "Render a joins count series as a line of block characters"
+        highest = max(series, default=0)
+        if highest == 0:
+            return SPARKLINE_CHARS[0] * len(series)
+        scale = len(SPARKLINE_CHARS) - 1
+        return "".join(SPARKLINE_CHARS[round(count * scale / highest)] for count in series)
@@ -1,7 +1,11 @@
+import asyncio
 import logging
 import random
+import tempfile
+import time
+from collections import Counter
 from datetime import datetime, timedelta, timezone
-from typing import Optional, Union
+from typing import Literal, Optional, Union
 from uuid import uuid4
 
 import discord
@@ -10,14 +14,42 @@ from discord.app_commands import Choice, Range
 from discord.ext import commands, tasks
 
 from src.cobot import CObot, COInteraction
-from src.modules.giveaways.types import GiveawayData, GiveawayToSendData
-from src.modules.giveaways.views import GiveawayView, ParticipantsPaginator
+from src.firebase.resilience import BackendUnavailableError
+from src.modules.giveaways.export import write_participants_csv
+from src.modules.giveaways.join_rate import JoinRateTracker
+from src.modules.giveaways.types import GiveawayRecord, GiveawayToSendData
+from src.modules.giveaways.views import (GiveawaysListPaginator, GiveawayView,
+                                         ParticipantsPaginator)
 from src.utils.confirm_view import ConfirmView
 from src.utils.custom_args import ColorOption, DateOption, DurationOption
+from src.utils.token_bucket import TokenBucketLimiter
 
 AcceptableChannel = (discord.TextChannel, discord.Thread, discord.StageChannel, discord.VoiceChannel)
 AcceptableChannelType = Union[discord.TextChannel, discord.Thread, discord.StageChannel, discord.VoiceChannel]
 
+GiveawayListFilter = Literal["active", "ending soon", "ended", "archived", "all"]
+ENDING_SOON_DELAY = timedelta(days=1)
+SCHEDULE_INTERVAL = timedelta(minutes=5)
+DEFAULT_RECONCILE_MINUTES = 30
+AUTOCOMPLETE_CHOICES_LIMIT = 25
+# number of soonest ending giveaways whose participants are loaded on startup, and how many are fetched at once
+PREWARM_PARTICIPANTS_LIMIT = 50
+PREWARM_CONCURRENCY = 8
+# joins are only answered without deferring if we got the interaction quickly enough, as Discord gives us 3s to answer
+JOIN_FAST_PATH_BUDGET = timedelta(seconds=1.5)
+# default limits of join clicks per user and giveaway: a token every 10s, with bursts of 3 clicks
+DEFAULT_JOIN_RATE = 0.1
+DEFAULT_JOIN_BURST = 3
+# number of minutes displayed in the joins chart of /giveaways stats
+STATS_CHART_MINUTES = 30
+LIST_TITLES: dict[str, tuple[str, str]] = {
+    "active": ("List of active giveaways", "No active giveaways"),
+    "ending soon": ("List of giveaways ending soon", "No giveaways ending in the next 24 hours"),
+    "ended": ("List of ended giveaways", "No ended giveaways"),
+    "archived": ("List of archived giveaways", "No archived giveaways"),
+    "all": ("List of all giveaways", "No giveaways"),
+}
+
 
 class GiveawaysCog(commands.Cog):
     "Handle giveaways"
@@ -27,16 +59,75 @@ class GiveawaysCog(commands.Cog):
         self.embed_color = 0x9933ff
         self.scheduler = AsyncIOScheduler()
         self.log = logging.getLogger("cobot.giveaways")
+        self.participants_paginator = ParticipantsPaginator(self.bot, self.embed_color)
+        self.list_paginator = GiveawaysListPaginator(self.bot, self.embed_color, self.query_listed_giveaways, LIST_TITLES)
+        # set once the active giveaways and their participants have been loaded after startup
+        self.cache_ready = asyncio.Event()
+        self._prewarm_task: Optional[asyncio.Task] = None
+        # joins per minute of each giveaway, since the cog was loaded
+        self.join_rates: dict[str, JoinRateTracker] = {}
+        # how many joins were answered directly ("fast"), after deferring ("cold" cache, or "late" interaction),
+        # or were refused by the clicks limiter ("throttled")
+        self.join_path_counts: Counter[str] = Counter()
+        self.join_limiter: TokenBucketLimiter[tuple[int, str]] = TokenBucketLimiter(
+            rate=self.bot.config.get("GIVEAWAYS_JOIN_RATE", DEFAULT_JOIN_RATE),
+            capacity=self.bot.config.get("GIVEAWAYS_JOIN_BURST", DEFAULT_JOIN_BURST)
+        )
 
     async def cog_load(self):
-        """Start the scheduler on cog load"""
+        """Start the scheduler and register the paginators on cog load"""
+        self.bot.add_stateless_paginator(self.participants_paginator)
+        self.bot.add_stateless_paginator(self.list_paginator)
         self.scheduler.start()
+        # check for ending giveaways every 5 minutes of the bot clock
+        self.schedule_giveaways.change_interval( # pylint: disable=no-member
+            seconds=self.bot.clock.to_real_seconds(SCHEDULE_INTERVAL.total_seconds())
+        )
         self.schedule_giveaways.start() # pylint: disable=no-member
+        self.reconcile_cache.change_interval( # pylint: disable=no-member
+            minutes=self.bot.config.get("CACHE_RECONCILE_MINUTES", DEFAULT_RECONCILE_MINUTES)
+        )
+        self.reconcile_cache.start() # pylint: disable=no-member
+        if self.bot.config.get("GIVEAWAYS_ARCHIVE_AFTER_DAYS"):
+            self.archive_giveaways.start() # pylint: disable=no-member
 
     async def cog_unload(self):
-        """Stop the scheduler on cog unload"""
+        """Stop the scheduler and unregister the paginators on cog unload"""
+        self.bot.remove_stateless_paginator(self.participants_paginator.name)
+        self.bot.remove_stateless_paginator(self.list_paginator.name)
         self.scheduler.shutdown()
         self.schedule_giveaways.stop() # pylint: disable=no-member
+        self.archive_giveaways.cancel() # pylint: disable=no-member
+        self.reconcile_cache.cancel() # pylint: disable=no-member
+        if self._prewarm_task is not None:
+            self._prewarm_task.cancel()
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        "Start prewarming the cache once the bot is ready (on_ready may be called again after a reconnection)"
+        if self._prewarm_task is None:
+            self._prewarm_task = asyncio.create_task(self.prewarm_cache())
+
+    async def prewarm_cache(self):
+        "Load the active giveaways and the participants of the ones ending soonest, so the first joins are served from cache"
+        start = time.perf_counter()
+        try:
+            giveaways_count, participants_count = await self.bot.fb.prewarm_cache(
+                PREWARM_PARTICIPANTS_LIMIT, PREWARM_CONCURRENCY
+            )
+        except Exception as err: # pylint: disable=broad-except
+            self.bot.dispatch("error", err, "While prewarming the giveaways cache")
+            return
+        finally:
+            # joins still work with a cold cache, they just can't use the fast path
+            self.cache_ready.set()
+        self.log.info("Cache prewarmed in %.2fs: %s active giveaways, %s participants",
+                      time.perf_counter() - start, giveaways_count, participants_count)
+
+    def is_cache_hot(self, giveaway_id: str):
+        "Check whether a join on a giveaway can be answered from the cache only, without any database request"
+        return self.cache_ready.is_set() and self.bot.fb.get_cached_giveaway(giveaway_id) is not None \
+            and self.bot.fb.get_cached_participants(giveaway_id) is not None
 
     @commands.Cog.listener()
     async def on_interaction(self, interaction: discord.Interaction):
@@ -51,23 +142,74 @@ class GiveawaysCog(commands.Cog):
         custom_ids = interaction.data["custom_id"].split('-')
         if len(custom_ids) != 2 or custom_ids[0] != "gaw":
             return # not a giveaway button
-        await interaction.response.defer(ephemeral=True)
         gaw_id = custom_ids[1]
-        gaw = await self.bot.fb.get_giveaway(gaw_id)
-        if gaw is None or gaw["ended"] or gaw["ends_at"] < discord.utils.utcnow():
-            return # giveaway not found or ended
-        await self.register_new_participant(interaction, gaw)
+        if await self.bot.reject_if_draining(interaction):
+            return
+        if refused_count := self.join_limiter.consume((interaction.user.id, gaw_id)):
+            self.join_path_counts["throttled"] += 1
+            # only answer the first refused click, so spamming the button doesn't cost us anything
+            if refused_count == 1:
+                await interaction.response.send_message("You're clicking too fast, please wait a bit!", ephemeral=True)
+            return
+        with self.bot.track_work():
+            await self.handle_join_click(interaction, gaw_id)
+
+    async def handle_join_click(self, interaction: discord.Interaction, gaw_id: str):
+        "Answer a click on a giveaway Join button"
+        # answer in a single request if everything we need is cached, otherwise defer to get more time
+        if not self.is_cache_hot(gaw_id):
+            self.join_path_counts["cold"] += 1
+            await interaction.response.defer(ephemeral=True)
+        elif discord.utils.utcnow() - interaction.created_at > JOIN_FAST_PATH_BUDGET:
+            self.join_path_counts["late"] += 1
+            await interaction.response.defer(ephemeral=True)
+        else:
+            self.join_path_counts["fast"] += 1
+        try:
+            gaw = await self.bot.fb.get_giveaway(gaw_id)
+            if gaw is None:
+                await self._reply(interaction, "This giveaway doesn't exist anymore!")
+                return
+            if gaw["ended"] or gaw["ends_at"] < self.bot.clock.now():
+                await self._reply(interaction, "This giveaway has ended!")
+                return
+            await self.register_new_participant(interaction, gaw)
+        except BackendUnavailableError:
+            self.log.warning("Database unavailable, can't answer a join of giveaway %s", gaw_id)
+            await self._reply(interaction, "The database is unavailable right now, please try again in a few minutes!")
 
     @tasks.loop(minutes=5)
     async def schedule_giveaways(self):
         "Check for expired giveaways and schedule their closing"
-        now = discord.utils.utcnow()
-        date_treshold = now + timedelta(minutes=5)
-        async for giveaway in self.bot.fb.get_active_giveaways():
-            if giveaway["ends_at"] < date_treshold:
-                self.log.debug("Scheduling closing of giveaway %s", giveaway['id'])
-                run_date = max(giveaway["ends_at"], now)
-                self.scheduler.add_job(self.close_giveaway, "date", run_date=run_date, args=[giveaway])
+        now = self.bot.clock.now()
+        date_treshold = now + SCHEDULE_INTERVAL
+        for giveaway in await self.bot.fb.query_giveaways(ended=False, ends_before=date_treshold):
+            self.log.debug("Scheduling closing of giveaway %s", giveaway['id'])
+            run_date = max(giveaway["ends_at"], now)
+            # the scheduler runs on real time, which may be slower than our clock
+            real_run_date = self.bot.clock.to_real_datetime(run_date)
+            # a fixed job ID, so scheduling a giveaway again only moves its job
+            self.scheduler.add_job(self._close_giveaway_job, "date", run_date=real_run_date, args=[giveaway],
+                                   id=f"close-{giveaway['id']}", replace_existing=True)
+
+    async def _close_giveaway_job(self, giveaway: GiveawayRecord):
+        "Scheduled closing of a giveaway, tracked so that shutdowns wait for it"
+        with self.bot.track_work():
+            try:
+                await self.close_giveaway(giveaway)
+            except BackendUnavailableError as err:
+                # the giveaway is still active in the database, so the next scheduling pass will try again
+                self.log.warning("Database unavailable, closing of giveaway %s postponed: %s", giveaway['id'], err)
+
+    async def cog_drain(self):
+        """Called before the bot shuts down: stop scheduling closings, and report the pending ones
+        They don't need to be saved, as they're scheduled again from the database on startup"""
+        self.schedule_giveaways.cancel() # pylint: disable=no-member
+        self.archive_giveaways.cancel() # pylint: disable=no-member
+        self.reconcile_cache.cancel() # pylint: disable=no-member
+        self.scheduler.pause()
+        jobs_count = len(self.scheduler.get_jobs())
+        return f"{jobs_count} scheduled giveaway closings paused, they will be scheduled again on startup"
 
     @schedule_giveaways.before_loop
     async def on_schedule_giveaways_before(self):
@@ -79,6 +221,46 @@ class GiveawaysCog(commands.Cog):
         "Log errors from the scheduler"
         self.bot.dispatch("error", error)
 
+    @tasks.loop(hours=24)
+    async def archive_giveaways(self):
+        "Move giveaways that ended a long time ago out of the hot database tree"
+        days: int = self.bot.config["GIVEAWAYS_ARCHIVE_AFTER_DAYS"]
+        ended_before = self.bot.clock.now() - timedelta(days=days)
+        if count := await self.bot.fb.archive_giveaways(ended_before):
+            self.log.info("Archived %s giveaways ended more than %s days ago", count, days)
+
+    @archive_giveaways.before_loop
+    async def on_archive_giveaways_before(self):
+        "Wait for the bot to be ready before archiving anything"
+        await self.bot.wait_until_ready()
+
+    @archive_giveaways.error
+    async def on_archive_giveaways_error(self, error: BaseException):
+        "Log errors from the archival task"
+        self.bot.dispatch("error", error)
+
+    @tasks.loop(minutes=DEFAULT_RECONCILE_MINUTES)
+    async def reconcile_cache(self):
+        "Check that the cached giveaways and participants didn't drift from the database, and fix them if they did"
+        stats = await self.bot.fb.reconcile_cache()
+        drifted = {key: value for key, value in stats.items() if not key.endswith("_checked")}
+        if drifted:
+            self.log.warning("Cache drift found and fixed: %s (total since startup: %s)",
+                             drifted, dict(self.bot.fb.drift_stats))
+        else:
+            self.log.debug("No cache drift found (%s)", dict(stats))
+
+    @reconcile_cache.before_loop
+    async def on_reconcile_cache_before(self):
+        "Wait for the cache to be loaded before checking it"
+        await self.bot.wait_until_ready()
+        await self.cache_ready.wait()
+
+    @reconcile_cache.error
+    async def on_reconcile_cache_error(self, error: BaseException):
+        "Log errors from the reconciler"
+        self.bot.dispatch("error", error)
+
     group = discord.app_commands.Group(
         name="giveaways",
         description="Manage giveaways in your server",
@@ -87,49 +269,32 @@ class GiveawaysCog(commands.Cog):
     )
 
     @group.command(name="list")
-    async def gw_list(self, interaction: COInteraction, *, include_stopped: bool=False):
-        "List all the giveaways in the server"
+    async def gw_list(self, interaction: COInteraction, *, status: GiveawayListFilter="active"):
+        "List the giveaways in the server"
+        if interaction.guild is None:
+            return
         await interaction.response.defer()
-        text = ""
-        now = discord.utils.utcnow()
-        docs = self.bot.fb.get_giveaways() if include_stopped else self.bot.fb.get_active_giveaways()
-        async for gaw in docs:
-            name = gaw["name"]
-            message_url = f"https://discord.com/channels/{gaw['guild']}/{gaw['channel']}/{gaw['message']}"
-            text += f"- **[{name}]({message_url})**  -  "
-            if participants := await self.bot.fb.get_giveaways_participants(gaw["id"]):
-                participants_count = len(participants)
-            else:
-                participants_count = 0
-            if max_entries := gaw.get("max_entries"):
-                text += f"{participants_count}/{max_entries} participants - "
-            else:
-                text += f"{participants_count} participants - "
-            max_winners_count = gaw['winners_count']
-            if gaw["ended"]:
-                winners_count = len(gaw["winners"])
-                text += f"{winners_count}/{max_winners_count} winners - "
-            else:
-                text += f"{max_winners_count} max winners - "
-            end_date = discord.utils.format_dt(gaw["ends_at"], "R")
-            if gaw["ends_at"] > now:
-                text += f"ends {end_date}\n"
-            else:
-                text += f"ended {end_date}\n"
-        if not text:
-            text = "No giveaways" if include_stopped else "No active giveaways"
-        embed = discord.Embed(
-            title=("List of all giveaways" if include_stopped else "List of active giveaways"),
-            description=text,
-            color=self.embed_color
-        )
-        await interaction.followup.send(embed=embed)
+        await self.list_paginator.send_init(interaction, status)
+
+    async def query_listed_giveaways(self, guild_id: int, status: str):
+        "Get the giveaways of a guild matching a /giveaways list filter, sorted by end date"
+        if status == "active":
+            return await self.bot.fb.query_giveaways(guild_id=guild_id, ended=False)
+        if status == "ending soon":
+            return await self.bot.fb.query_giveaways(
+                guild_id=guild_id, ended=False, ends_before=self.bot.clock.now() + ENDING_SOON_DELAY
+            )
+        if status == "ended":
+            return await self.bot.fb.query_giveaways(guild_id=guild_id, ended=True)
+        if status == "archived":
+            return await self.bot.fb.get_archived_giveaways(guild_id)
+        return await self.bot.fb.query_giveaways(guild_id=guild_id)
 
     @group.command(name="create")
     async def gw_create(self, interaction: COInteraction, *, name: Range[str, 2, 30], description: Range[str, 2, 256],
                         duration: DurationOption, channel: Optional[AcceptableChannelType]=None,
                         color: Optional[ColorOption]=None, max_entries: Optional[int]=None,
-                        winners_count: int=1):
+                        required_role: Optional[discord.Role]=None, winners_count: int=1):
         "Create a giveaway"
         if interaction.guild is None:
             return
@@ -144,7 +309,7 @@ class GiveawaysCog(commands.Cog):
             await interaction.response.send_message("I need the permission to send messages and embed links in this channel!")
             return
         await interaction.response.defer()
-        ends_date = discord.utils.utcnow() + timedelta(seconds=duration)
+        ends_date = self.bot.clock.now() + timedelta(seconds=duration)
         if max_entries is not None and winners_count > max_entries:
             winners_count = max_entries
         data: GiveawayToSendData = {
@@ -155,6 +320,7 @@ class GiveawaysCog(commands.Cog):
             "description": description,
             "color": color.value if color else self.embed_color,
             "max_entries": max_entries,
+            "required_role": required_role.id if required_role else None,
             "winners_count": winners_count,
             "ends_at": ends_date,
             "ended": False,
@@ -173,7 +339,7 @@ class GiveawaysCog(commands.Cog):
         if interaction.guild is None:
             return
         await interaction.response.defer()
-        gaw = await self.bot.fb.get_giveaway(giveaway)
+        gaw = await self.bot.fb.get_giveaway(giveaway, include_archived=True)
         if gaw is None:
             await interaction.followup.send("Giveaway not found!")
             return
@@ -195,6 +361,7 @@ class GiveawaysCog(commands.Cog):
                 await confirm_view.disable(interaction)
                 return
         await self.bot.fb.delete_giveaway(giveaway)
+        self.join_rates.pop(giveaway, None)
         await interaction.followup.send("Giveaway deleted!")
 
     @gw_delete.autocomplete("giveaway")
@@ -202,14 +369,7 @@ class GiveawaysCog(commands.Cog):
         "Autocomplete for the giveaway argument of the delete command"
         if interaction.guild_id is None:
             return []
-        current = current.lower()
-        choices: list[tuple[bool, str, Choice[str]]] = []
-        async for gaw in self.bot.fb.get_giveaways():
-            if gaw["guild"] == interaction.guild_id and current in gaw["name"].lower():
-                priority = not gaw["name"].lower().startswith(current)
-                choice = Choice(name=gaw["name"], value=gaw["id"])
-                choices.append((priority, gaw["name"], choice))
-        return [choice for _, _, choice in sorted(choices, key=lambda x: x[0:2])]
+        return await self._get_giveaway_choices(interaction.guild_id, current)
 
     @group.command(name="edit")
     async def gw_edit(self, interaction: COInteraction, giveaway: str, *,
@@ -222,7 +382,7 @@ class GiveawaysCog(commands.Cog):
         if all(arg is None for arg in (name, description, utc_end_date, color, max_entries, winners_count)):
             await interaction.response.send_message("You must provide at least one argument to edit!")
             return
-        if utc_end_date is not None and utc_end_date < discord.utils.utcnow():
+        if utc_end_date is not None and utc_end_date < self.bot.clock.now():
             await interaction.response.send_message("The end date must be in the future!")
             return
         await interaction.response.defer()
@@ -255,14 +415,7 @@ class GiveawaysCog(commands.Cog):
         "Autocomplete for the giveaway argument of the edit command"
         if interaction.guild_id is None:
             return []
-        current = current.lower()
-        choices: list[tuple[bool, str, Choice[str]]] = []
-        async for gaw in self.bot.fb.get_giveaways():
-            if gaw["guild"] == interaction.guild_id and current in gaw["name"].lower():
-                priority = not gaw["name"].lower().startswith(current)
-                choice = Choice(name=gaw["name"], value=gaw["id"])
-                choices.append((priority, gaw["name"], choice))
-        return [choice for _, _, choice in sorted(choices, key=lambda x: x[0:2])]
+        return await self._get_giveaway_choices(interaction.guild_id, current)
 
     @group.command(name="list-participants")
     async def gw_list_participants(self, interaction: COInteraction, giveaway: str):
@@ -270,7 +423,7 @@ class GiveawaysCog(commands.Cog):
         if interaction.guild is None:
             return
         await interaction.response.defer()
-        gaw = await self.bot.fb.get_giveaway(giveaway)
+        gaw = await self.bot.fb.get_giveaway(giveaway, include_archived=True)
         if gaw is None:
             await interaction.followup.send("Giveaway not found!")
             return
@@ -281,22 +434,85 @@ class GiveawaysCog(commands.Cog):
         if not participants:
             await interaction.followup.send("No participants!")
             return
-        view = ParticipantsPaginator(self.bot, self.embed_color, interaction.user, gaw, participants)
-        await view.send_init(interaction)
+        await self.participants_paginator.send_init(interaction, gaw["id"])
 
     @gw_list_participants.autocomplete("giveaway")
     async def gw_list_participants_autocomplete(self, interaction: COInteraction, current: str):
         "Autocomplete for the giveaway argument of the list-participants command"
         if interaction.guild_id is None:
             return []
-        current = current.lower()
-        choices: list[tuple[bool, str, Choice[str]]] = []
-        async for gaw in self.bot.fb.get_giveaways():
-            if gaw["guild"] == interaction.guild_id and current in gaw["name"].lower():
-                priority = not gaw["name"].lower().startswith(current)
-                choice = Choice(name=gaw["name"], value=gaw["id"])
-                choices.append((priority, gaw["name"], choice))
-        return [choice for _, _, choice in sorted(choices, key=lambda x: x[0:2])]
+        return await self._get_giveaway_choices(interaction.guild_id, current)
+
+    @group.command(name="export")
+    async def gw_export_participants(self, interaction: COInteraction, giveaway: str):
+        "Export the participants and winners of a giveaway as a compressed CSV file"
+        if interaction.guild is None:
+            return
+        await interaction.response.defer()
+        gaw = await self.bot.fb.get_giveaway(giveaway, include_archived=True)
+        if gaw is None:
+            await interaction.followup.send("Giveaway not found!")
+            return
+        if gaw["guild"] != interaction.guild.id:
+            await interaction.followup.send("You can only export participants of giveaways in your own server!")
+            return
+        with tempfile.TemporaryFile() as file:
+            rows_count = await write_participants_csv(
+                file, self.bot.fb.iter_giveaway_participants_pages(gaw["id"]), gaw["winners"]
+            )
+            file.seek(0)
+            await interaction.followup.send(
+                f"{rows_count} participants exported!",
+                file=discord.File(file, filename=f"giveaway-{gaw['id']}-participants.csv.gz")
+            )
+
+    @gw_export_participants.autocomplete("giveaway")
+    async def gw_export_participants_autocomplete(self, interaction: COInteraction, current: str):
+        "Autocomplete for the giveaway argument of the export command"
+        if interaction.guild_id is None:
+            return []
+        return await self._get_giveaway_choices(interaction.guild_id, current)
+
+    @group.command(name="stats")
+    async def gw_stats(self, interaction: COInteraction, giveaway: str):
+        "Show how fast people joined a giveaway"
+        if interaction.guild is None:
+            return
+        await interaction.response.defer()
+        gaw = await self.bot.fb.get_giveaway(giveaway, include_archived=True)
+        if gaw is None:
+            await interaction.followup.send("Giveaway not found!")
+            return
+        if gaw["guild"] != interaction.guild.id:
+            await interaction.followup.send("You can only see stats of giveaways in your own server!")
+            return
+        tracker = self.join_rates.get(gaw["id"])
+        if tracker is None or tracker.total == 0:
+            await interaction.followup.send("No one joined this giveaway since my last restart!")
+            return
+        now = self.bot.clock.time()
+        series = tracker.series(now, STATS_CHART_MINUTES)
+        embed = discord.Embed(title=f"Joins of {gaw['name']}", color=self.embed_color)
+        embed.add_field(name="Last minute", value=f"{series[-1]} joins")
+        embed.add_field(name="Last 10 minutes", value=f"{tracker.rate(now, 10):.1f} joins/min")
+        embed.add_field(name=f"Last {tracker.window} minutes", value=f"{tracker.rate(now, tracker.window):.1f} joins/min")
+        if tracker.peak_minute is not None:
+            peak_date = datetime.fromtimestamp(tracker.peak_minute * 60, tz=timezone.utc)
+            embed.add_field(name="Peak rate", value=f"{tracker.peak} joins/min {discord.utils.format_dt(peak_date, 'R')}")
+        embed.add_field(
+            name=f"Joins per minute, last {len(series)} minutes (max {max(series)})",
+            value=f"`{JoinRateTracker.sparkline(series)}`",
+            inline=False
+        )
+        embed.set_footer(text=f"{tracker.total} joins recorded since my last restart")
+        await interaction.followup.send(embed=embed)
+
+    @gw_stats.autocomplete("giveaway")
+    async def gw_stats_autocomplete(self, interaction: COInteraction, current: str):
+        "Autocomplete for the giveaway argument of the stats command"
+        if interaction.guild_id is None:
+            return []
+        return await self._get_giveaway_choices(interaction.guild_id, current)
 
     @group.command(name="reroll")
     async def gw_reroll_winners(self, interaction: COInteraction, giveaway: str):
@@ -304,7 +520,7 @@ class GiveawaysCog(commands.Cog):
         if interaction.guild is None:
             return
         await interaction.response.defer(ephemeral=True)
-        gaw = await self.bot.fb.get_giveaway(giveaway)
+        gaw = await self.bot.fb.get_giveaway(giveaway, include_archived=True)
         if gaw is None:
             await interaction.followup.send("Giveaway not found!")
             return
@@ -314,8 +530,11 @@ class GiveawaysCog(commands.Cog):
         if not gaw["ended"]:
             await interaction.followup.send("You can only reroll winners of ended giveaways!")
             return
-        gaw["ended"] = False
-        await self.close_giveaway(gaw)
+        ineligible_count = await self.close_giveaway(gaw, reroll=True)
+        if ineligible_count is None:
+            await interaction.followup.send("Winners of this giveaway were already rerolled meanwhile, nothing was \
+changed!")
+            return
         winners = gaw["winners"]
         if len(winners) == 0:
             txt = "No new winners picked"
@@ -323,6 +542,8 @@ class GiveawaysCog(commands.Cog):
             txt = f"1 new winner picked: <@{winners[0]}>"
         else:
             txt = f"{len(winners)} new winners picked: {' '.join(f'<@{winner}>' for winner in winners)}"
+        if ineligible_count:
+            txt += f"\n{ineligible_count} participants were not eligible anymore (left the server or lost the required role)"
         await interaction.followup.send("Giveaway rerolled!\n" + txt, allowed_mentions=discord.AllowedMentions.none())
 
     @gw_reroll_winners.autocomplete("giveaway")
@@ -330,16 +551,25 @@ class GiveawaysCog(commands.Cog):
         "Autocomplete for the giveaway argument of the reroll command"
         if interaction.guild_id is None:
             return []
+        return await self._get_giveaway_choices(interaction.guild_id, current, ended_only=True)
+
+    async def _get_giveaway_choices(self, guild_id: int, current: str, ended_only: bool=False):
+        """Build the autocomplete choices for a giveaway argument
+        Giveaways are streamed, and we stop reading them once Discord's choices limit is reached"""
         current = current.lower()
         choices: list[tuple[bool, str, Choice[str]]] = []
-        async for gaw in self.bot.fb.get_giveaways():
-            if gaw["guild"] == interaction.guild_id and gaw["ended"] and current in gaw["name"].lower():
+        async for gaw in self.bot.fb.get_giveaways(guild_id=guild_id):
+            if ended_only and not gaw["ended"]:
+                continue
+            if current in gaw["name"].lower():
                 priority = not gaw["name"].lower().startswith(current)
                 choice = Choice(name=gaw["name"], value=gaw["id"])
                 choices.append((priority, gaw["name"], choice))
+                if len(choices) >= AUTOCOMPLETE_CHOICES_LIMIT:
+                    break
         return [choice for _, _, choice in sorted(choices, key=lambda x: x[0:2])]
 
-    async def create_active_gaw_embed(self, data: GiveawayToSendData, participants_count: int=0):
+    async def create_active_gaw_embed(self, data: Union[GiveawayToSendData, GiveawayRecord], participants_count: int=0):
         "Create a Discord embed for an active giveaway"
         embed = discord.Embed(
             title=data["name"],
@@ -361,7 +591,7 @@ class GiveawaysCog(commands.Cog):
         msg = await channel.send(embed=embed, view=view)
         return msg
 
-    async def fetch_gaw_message(self, data: GiveawayData):
+    async def fetch_gaw_message(self, data: GiveawayRecord):
         "Fetch the Discord message for a giveaway"
         channel = self.bot.get_channel(data["channel"])
         if not isinstance(channel, AcceptableChannel):
@@ -372,7 +602,7 @@ class GiveawaysCog(commands.Cog):
             return None
         return message
 
-    async def increase_gaw_embed_participants(self, data: GiveawayData, participants_count: Optional[int]=None):
+    async def increase_gaw_embed_participants(self, data: GiveawayRecord, participants_count: Optional[int]=None):
         "Fetch the Discord message for a giveaway, parse it and increment the participants count"
         message = await self.fetch_gaw_message(data)
         if message is None:
@@ -388,41 +618,88 @@ class GiveawaysCog(commands.Cog):
         embed.set_field_at(0, name="Participants", value="/".join(field_value))
         await message.edit(embed=embed)
 
-    async def register_new_participant(self, interaction: discord.Interaction, giveaway: GiveawayData):
-        """Register a new participant to a giveaway (when they click on the Join button)"""
+    async def _reply(self, interaction: discord.Interaction, content: str, **kwargs):
+        "Send an ephemeral answer to a join interaction, whether it has been deferred or not"
+        if interaction.response.is_done():
+            await interaction.followup.send(content, ephemeral=True, **kwargs)
+        else:
+            await interaction.response.send_message(content, ephemeral=True, **kwargs)
+
+    async def register_new_participant(self, interaction: discord.Interaction, giveaway: GiveawayRecord):
+        """Register a new participant to a giveaway (when they click on the Join button)
+        If the interaction was not deferred, every check must be answerable from the cache"""
+        if (role_id := giveaway.get("required_role")) and isinstance(interaction.user, discord.Member) \
+                and interaction.user.get_role(role_id) is None:
+            await self._reply(
+                interaction,
+                f"{interaction.user.mention} you need the <@&{role_id}> role to join this giveaway!",
+                allowed_mentions=discord.AllowedMentions.none()
+            )
+            return
         if await self.bot.fb.check_giveaway_participant(giveaway["id"], interaction.user.id):
-            await interaction.followup.send(f"{interaction.user.mention} you already joined the giveaway!", ephemeral=True)
+            await self._reply(interaction, f"{interaction.user.mention} you already joined the giveaway!")
             return
         if max_entries := giveaway.get("max_entries"):
             participants = await self.bot.fb.get_giveaways_participants(giveaway["id"])
             if participants is not None and len(participants) >= max_entries:
-                await interaction.followup.send(
+                await self._reply(
+                    interaction,
                     f"{interaction.user.mention} the limit of participants for this giveaway has been reached! \
-Maybe you'll be luckier next time...",
+Maybe you'll be luckier next time..."
+                )
+                return
+        joined_text = f"{interaction.user.mention} you joined the giveaway, good luck!"
+        if interaction.response.is_done():
+            await self.bot.fb.add_giveaway_participant(giveaway["id"], interaction.user.id)
+            await self._reply(interaction, joined_text)
+        else:
+            # answer before writing, as Discord won't wait for us; writes are queued if the database is unavailable
+            self.bot.fb.reserve_cached_participant(giveaway["id"], interaction.user.id)
+            try:
+                await self._reply(interaction, joined_text)
+            except BaseException:
+                self.bot.fb.release_cached_participant(giveaway["id"], interaction.user.id)
+                raise
+            try:
+                await self.bot.fb.add_giveaway_participant(giveaway["id"], interaction.user.id)
+            except Exception as err: # pylint: disable=broad-except
+                self.bot.dispatch("error", err, f"While adding a participant to giveaway {giveaway['id']}")
+                await interaction.followup.send(
+                    f"{interaction.user.mention} sorry, your participation couldn't be saved, please try again!",
                     ephemeral=True
                 )
                 return
-        await self.bot.fb.add_giveaway_participant(giveaway["id"], interaction.user.id)
-        await interaction.followup.send(f"{interaction.user.mention} you joined the giveaway, good luck!", ephemeral=True)
-        if self.bot.fb.cache.are_participants_sync(giveaway["id"]) and (
-                participants := self.bot.fb.cache.get_participants(giveaway["id"])):
+        self.join_rates.setdefault(giveaway["id"], JoinRateTracker()).record(self.bot.clock.time())
+        if participants := self.bot.fb.get_cached_participants(giveaway["id"]):
             participants_count = len(participants)
         else:
             participants_count = None
         await self.increase_gaw_embed_participants(giveaway, participants_count=participants_count)
 
-    async def close_giveaway(self, data: GiveawayData):
-        "Close a giveaway and pick the winners"
-        if data["ended"]:
-            return
+    async def close_giveaway(self, data: GiveawayRecord, reroll: bool=False) -> Optional[int]:
+        """Close a giveaway and pick its winners (or pick new winners of an ended one if 'reroll' is set), and return
+        how many participants were not eligible anymore
+        The closing is claimed in the database before anything else, so if several instances (or scheduler runs)
+        close the same giveaway, only one of them picks and announces its winners and the others return None"""
+        if data["ended"] and not reroll:
+            return None
         self.log.info("Closing giveaway %s", data['id'])
+        previous_winners = list(data["winners"]) if reroll else None
+        claim = await self.bot.fb.claim_giveaway_closing(data["id"], previous_winners=previous_winners)
+        if claim is None:
+            self.log.info("Giveaway %s was closed by another run, skipping it", data['id'])
+            return None
+        winners, ineligible_count = await self.pick_giveaway_winners(data)
+        if not await self.bot.fb.close_giveaway(data["id"], claim, winners):
+            self.log.info("Giveaway %s was claimed by another run meanwhile, skipping the announcement", data['id'])
+            return None
         message = await self.fetch_gaw_message(data)
         if message is None:
-            return
+            self.log.warning("Message of giveaway %s couldn't be found, its winners were not announced", data['id'])
+            return ineligible_count
         # edit initial embed
         embed = message.embeds[0]
         embed.set_footer(text="Ended at")
-        winners = await self.pick_giveaway_winners(data)
         if len(winners) == 0:
             embed.add_field(name="Winners", value="No one joined the giveaway...")
         elif len(winners) < 35:
@@ -444,21 +721,40 @@ Maybe you'll be luckier next time...",
             await message.reply(
                 f"Unfortunately, no one joined the **{data['name']}** giveaways...\nBetter luck next time!",
             )
-        # mark the giveaway as ended in the database
-        await self.bot.fb.close_giveaway(data["id"], winners)
+        return ineligible_count
 
-    async def pick_giveaway_winners(self, data: GiveawayData) -> list[int]:
-        "Fetch participants of a giveaway and randomly pick winners"
+    async def pick_giveaway_winners(self, data: GiveawayRecord) -> tuple[list[int], int]:
+        """Fetch participants of a giveaway and randomly pick winners among the eligible ones
+        Return the winners and the number of participants that were not eligible"""
         participants = await self.bot.fb.get_giveaways_participants(data["id"])
         if not participants:
-            return []
-        winners_count = min(data["winners_count"], len(participants))
-        return random.sample(participants, winners_count)
-
-    async def _merge_giveaways_data(self, original_data: GiveawayData,
+            return [], 0
+        eligible_participants = self.filter_eligible_participants(data, participants)
+        ineligible_count = len(participants) - len(eligible_participants)
+        if ineligible_count:
+            self.log.info("%s participants of giveaway %s are not eligible anymore", ineligible_count, data["id"])
+        winners_count = min(data["winners_count"], len(eligible_participants))
+        return random.sample(eligible_participants, winners_count), ineligible_count
+
+    def filter_eligible_participants(self, data: GiveawayRecord, participants: list[int]) -> list[int]:
+        """Keep only the participants that are still members of the giveaway guild, and that have its required role
+        This relies on the members cache, so nothing is filtered if the guild members are not fully cached"""
+        guild = self.bot.get_guild(data["guild"])
+        if guild is None or not guild.chunked:
+            return participants
+        eligible_ids = set(participants)
+        eligible_ids.intersection_update(member.id for member in guild.members)
+        if role_id := data.get("required_role"):
+            if (role := guild.get_role(role_id)) is not None:
+                eligible_ids.intersection_update(member.id for member in role.members)
+        if len(eligible_ids) == len(participants):
+            return participants
+        return [user_id for user_id in participants if user_id in eligible_ids]
+
+    async def _merge_giveaways_data(self, original_data: GiveawayRecord,
                                     name: Optional[str], description: Optional[str],
                                     utc_end_date: Optional[datetime], color: Optional[discord.Colour],
-                                    max_entries: Optional[int], winners_count: Optional[int]) -> GiveawayData:
+                                    max_entries: Optional[int], winners_count: Optional[int]) -> GiveawayRecord:
         "Update a given giveaway data with new values"
         if name is not None:
             original_data["name"] = name
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Literal, Optional, TypedDict, Union
+from typing import Any, Literal, Mapping, Optional, TypedDict, Union
 
 class GiveawayToSendData(TypedDict):
     "Data for a giveaway instance stored in Firestore"
@@ -10,6 +10,7 @@ class GiveawayToSendData(TypedDict):
     description: str
     color: int
     max_entries: Optional[int]
+    required_role: Optional[int]
     winners_count: int
     ends_at: datetime
     ended: bool
@@ -23,6 +24,7 @@ class _RawGiveawayDataWithWinners(TypedDict):
     description: str
     color: int
     max_entries: Optional[int]
+    required_role: Optional[int]
     winners_count: int
     ends_at: str
     ended: Literal[True]
@@ -37,6 +39,7 @@ class _RawGiveawayDataWithoutWinners(TypedDict):
     description: str
     color: int
     max_entries: Optional[int]
+    required_role: Optional[int]
     winners_count: int
     ends_at: str
     ended: Literal[False]
@@ -53,7 +56,114 @@ class GiveawayData(TypedDict):
     description: str
     color: int
     max_entries: Optional[int]
+    required_role: Optional[int]
     winners_count: int
     ends_at: datetime
     ended: bool
     winners: list[int]
+
+class GiveawayRecord:
+    """Compact giveaway instance, as stored in the Firebase cache
+    The end date is kept as its raw ISO string until first accessed, and records can be read and edited like
+    GiveawayData dicts (`gaw["name"]`, `gaw.get("max_entries")`, `gaw.update(...)`)"""
+
+    __slots__ = ("id", "guild", "channel", "message", "name", "description", "color", "max_entries",
+                 "required_role", "winners_count", "_ends_at", "ended", "winners")
+    FIELDS = ("id", "guild", "channel", "message", "name", "description", "color", "max_entries",
+              "required_role", "winners_count", "ends_at", "ended", "winners")
+
+    def __init__(self, giveaway_id: str, guild: int, channel: int, message: int, name: str, description: str,
+                 color: int, max_entries: Optional[int], required_role: Optional[int], winners_count: int,
+                 ends_at: Union[datetime, str], ended: bool, winners: list[int]):
+        self.id = giveaway_id # pylint: disable=invalid-name
+        self.guild = guild
+        self.channel = channel
+        self.message = message
+        self.name = name
+        self.description = description
+        self.color = color
+        self.max_entries = max_entries
+        self.required_role = required_role
+        self.winners_count = winners_count
+        self._ends_at = ends_at
+        self.ended = ended
+        self.winners = winners
+
+    @classmethod
+    def from_raw(cls, giveaway_id: str, raw: RawGiveawayData):
+        "Build a record from a raw database document, without parsing its end date yet"
+        return cls(
+            giveaway_id, raw["guild"], raw["channel"], raw["message"], raw["name"], raw["description"], raw["color"],
+            raw.get("max_entries"), raw.get("required_role"), raw["winners_count"], raw["ends_at"], raw["ended"],
+            raw.get("winners", [])
+        )
+
+    @classmethod
+    def from_data(cls, data: GiveawayData):
+        "Build a record from a parsed giveaway dict"
+        return cls(
+            data["id"], data["guild"], data["channel"], data["message"], data["name"], data["description"],
+            data["color"], data.get("max_entries"), data.get("required_role"), data["winners_count"], data["ends_at"],
+            data["ended"], data.get("winners", [])
+        )
+
+    @property
+    def ends_at(self) -> datetime:
+        "Giveaway end date, parsed on first access"
+        if isinstance(self._ends_at, str):
+            self._ends_at = datetime.fromisoformat(self._ends_at)
+        return self._ends_at
+
+    @ends_at.setter
+    def ends_at(self, value: datetime):
+        self._ends_at = value
+
+    def to_raw(self) -> RawGiveawayData:
+        "Convert the record into a database document"
+        return { # type: ignore
+            "guild": self.guild,
+            "channel": self.channel,
+            "message": self.message,
+            "name": self.name,
+            "description": self.description,
+            "color": self.color,
+            "max_entries": self.max_entries,
+            "required_role": self.required_role,
+            "winners_count": self.winners_count,
+            "ends_at": self._ends_at if isinstance(self._ends_at, str) else self._ends_at.isoformat(),
+            "ended": self.ended,
+            "winners": self.winners,
+        }
+
+    def __getitem__(self, key: str):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key: str, value):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def get(self, key: str, default=None):
+        "Get a field value, or a default value if the field doesn't exist"
+        if key not in self.FIELDS:
+            return default
+        return getattr(self, key)
+
+    def keys(self):
+        "Get the record field names"
+        return self.FIELDS
+
+    def items(self):
+        "Get the record (field name, value) pairs"
+        return ((key, getattr(self, key)) for key in self.FIELDS)
+
+    def update(self, data: Mapping[str, Any]):
+        "Update the record fields from a dict"
+        for key, value in data.items():
+            if key in self.FIELDS:
+                setattr(self, key, value)
+
+    def __repr__(self):
+        return f"<GiveawayRecord id={self.id!r} name={self.name!r} ended={self.ended}>"
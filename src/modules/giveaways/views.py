@@ -1,11 +1,13 @@
+import asyncio
+from datetime import datetime
 from math import ceil
-from typing import Union
+from typing import Awaitable, Callable
 
-from discord import ButtonStyle, Embed, Member, User, ui
+from discord import ButtonStyle, Embed, Interaction, ui, utils
 
 from src.cobot import CObot
-from src.modules.giveaways.types import GiveawayData, GiveawayToSendData
-from src.utils.paginator_view import Paginator
+from src.modules.giveaways.types import GiveawayRecord, GiveawayToSendData
+from src.utils.paginator_view import StatelessPaginator
 
 
 class GiveawayView(ui.View):
@@ -24,27 +26,36 @@ class GiveawayView(ui.View):
         self.add_item(enter_btn)
 
 
-class ParticipantsPaginator(Paginator):
-    "Allows users to see the participants of a giveaway"
-    def __init__(self, client: CObot, embed_color: int, user: Union[User, Member], gaw: GiveawayData, participants: list[int]):
-        super().__init__(client, user)
+class ParticipantsPaginator(StatelessPaginator):
+    """Allows users to see the participants of a giveaway
+    The data key is the giveaway ID, and pages are rebuilt from the participants cache on each click"""
+
+    def __init__(self, client: CObot, embed_color: int):
+        super().__init__(client, "participants")
         self.embed_color = embed_color
-        self.title = f"Participants of {gaw['name']}"
-        self.participants = participants
-        self.page_count = ceil(len(participants) / 20)
 
-    async def get_page_count(self) -> int:
+    async def _get_participants(self, giveaway_id: str):
+        "Get the giveaway and its participants"
+        # fetch the giveaway first, so we know where to look for the participants if it's archived
+        gaw = await self.client.fb.get_giveaway(giveaway_id, include_archived=True)
+        participants = await self.client.fb.get_giveaways_participants(giveaway_id) or []
+        return gaw, participants
+
+    async def get_page_count(self, interaction, key):
         "Get total number of available pages"
-        return self.page_count
+        _, participants = await self._get_participants(key)
+        return max(ceil(len(participants) / 20), 1)
 
-    async def get_page_content(self, interaction, page):
+    async def get_page_content(self, interaction, key, page):
         "Build the page content given the page number and source interaction"
+        gaw, participants = await self._get_participants(key)
+        page_count = max(ceil(len(participants) / 20), 1)
         lower_index = (page - 1) * 20
-        upper_index = min(page * 20, len(self.participants))
-        participants_count = len(self.participants)
+        upper_index = min(page * 20, len(participants))
+        participants_count = len(participants)
         page_participants = [
             f"<@{user_id}> ({user_id})"
-            for user_id in self.participants[lower_index:upper_index]
+            for user_id in participants[lower_index:upper_index]
         ]
         if participants_count == 1:
             desc_header = "### 1 participant"
@@ -53,9 +64,82 @@ class ParticipantsPaginator(Paginator):
         else:
             desc_header = f"### Participants {lower_index+1}-{upper_index} out of {participants_count}"
         embed = Embed(
-            title=self.title,
+            title=f"Participants of {gaw['name']}" if gaw else "Participants of a deleted giveaway",
             description=desc_header + "\n\n" + "\n".join(page_participants),
             color=self.embed_color
         )
-        embed.set_footer(text=f"Page {page}/{self.page_count}")
+        embed.set_footer(text=f"Page {page}/{page_count}")
         return {"embed": embed}
+
+
+class GiveawaysListPaginator(StatelessPaginator):
+    """Allows users to browse a list of giveaways
+    The data key is the list filter, and pages are rebuilt from the cache indexes on each click"""
+
+    GIVEAWAYS_PER_PAGE = 10
+
+    def __init__(self, client: CObot, embed_color: int,
+                 query_giveaways: Callable[[int, str], Awaitable[list[GiveawayRecord]]],
+                 titles: dict[str, tuple[str, str]]):
+        super().__init__(client, "giveaways")
+        self.embed_color = embed_color
+        self.query_giveaways = query_giveaways
+        self.titles = titles
+
+    async def _get_giveaways(self, interaction: Interaction, key: str):
+        "Get the giveaways listed for a given filter in the interaction guild"
+        if interaction.guild_id is None:
+            return []
+        return await self.query_giveaways(interaction.guild_id, key)
+
+    async def get_page_count(self, interaction, key):
+        "Get total number of available pages"
+        giveaways = await self._get_giveaways(interaction, key)
+        return max(ceil(len(giveaways) / self.GIVEAWAYS_PER_PAGE), 1)
+
+    async def get_page_content(self, interaction, key, page):
+        "Build the page content given the page number and source interaction"
+        giveaways = await self._get_giveaways(interaction, key)
+        page_count = max(ceil(len(giveaways) / self.GIVEAWAYS_PER_PAGE), 1)
+        lower_index = (page - 1) * self.GIVEAWAYS_PER_PAGE
+        upper_index = min(page * self.GIVEAWAYS_PER_PAGE, len(giveaways))
+        page_giveaways = giveaways[lower_index:upper_index]
+        # only fetch the participants of the giveaways displayed on this page
+        participants_lists = await asyncio.gather(*(
+            self.client.fb.get_giveaways_participants(gaw["id"])
+            for gaw in page_giveaways
+        ))
+        now = self.client.clock.now()
+        lines = [
+            self._format_giveaway(gaw, len(participants) if participants else 0, now)
+            for gaw, participants in zip(page_giveaways, participants_lists)
+        ]
+        title, empty_text = self.titles[key]
+        embed = Embed(
+            title=title,
+            description="\n".join(lines) or empty_text,
+            color=self.embed_color
+        )
+        if len(giveaways) > self.GIVEAWAYS_PER_PAGE:
+            embed.set_footer(text=f"Page {page}/{page_count} - {len(giveaways)} giveaways")
+        return {"embed": embed}
+
+    def _format_giveaway(self, gaw: GiveawayRecord, participants_count: int, now: datetime):
+        "Format a single giveaway line"
+        message_url = f"https://discord.com/channels/{gaw['guild']}/{gaw['channel']}/{gaw['message']}"
+        text = f"- **[{gaw['name']}]({message_url})**  -  "
+        if max_entries := gaw.get("max_entries"):
+            text += f"{participants_count}/{max_entries} participants - "
+        else:
+            text += f"{participants_count} participants - "
+        max_winners_count = gaw["winners_count"]
+        if gaw["ended"]:
+            text += f"{len(gaw['winners'])}/{max_winners_count} winners - "
+        else:
+            text += f"{max_winners_count} max winners - "
+        end_date = utils.format_dt(gaw["ends_at"], "R")
+        if gaw["ends_at"] > now:
+            text += f"ends {end_date}"
+        else:
+            text += f"ended {end_date}"
+        return text
@@ -0,0 +1,169 @@
+import asyncio
+from abc import ABC, abstractmethod
+from collections import Counter
+from datetime import datetime as dt
+from typing import AsyncGenerator, Optional
+
+from src.firebase.caching import FirebaseCacheControler
+from src.modules.giveaways.types import GiveawayData, GiveawayRecord
+from src.utils.clock import Clock
+
+
+class GiveawaysStorage(ABC):
+    """Interface of the giveaways storage backends
+    Every backend keeps its giveaways and participants in a FirebaseCacheControler, so cogs can tell whether a
+    request can be answered without waiting for the backend"""
+
+    def __init__(self, clock: Optional[Clock]=None):
+        self.clock = clock or Clock()
+        self.cache = FirebaseCacheControler(self.clock)
+        # participants not written to the backend yet, as (giveaway ID, user ID, join timestamp in ms)
+        self.pending_participants: list[tuple[str, int, int]] = []
+        # participants added to the cache by reserve_cached_participant, whose write didn't finish yet
+        self.reserved_participants: set[tuple[str, int]] = set()
+        # number of cache entries found out of sync with the backend since startup
+        self.drift_stats: Counter[str] = Counter()
+
+    async def close(self):
+        "Close the connections to the backend"
+
+    async def flush_writes(self) -> int:
+        "Write every queued write to the backend, and return the number of written participants"
+        return 0
+
+    async def reconcile_cache(self) -> Counter[str]:
+        "Compare the cache with the backend, fix the entries that drifted, and return the number of checked and fixed entries"
+        return Counter()
+
+    def save_cache_snapshot(self, path: str) -> int: # pylint: disable=unused-argument
+        "Save the cache into a file, to be loaded after a restart, and return the number of saved giveaways"
+        return 0
+
+    def load_cache_snapshot(self, path: str, max_age: float) -> bool: # pylint: disable=unused-argument
+        "Load the cache from a file saved before a restart, if it's recent enough, and return whether it was loaded"
+        return False
+
+    def get_cached_giveaway(self, giveaway_id: str) -> Optional[GiveawayRecord]:
+        "Get a giveaway document from the cache only, or None if it's not cached"
+        return self.cache.get_giveaway(giveaway_id)
+
+    def get_cached_participants(self, giveaway_id: str) -> Optional[list[int]]:
+        "Get the participants of a giveaway from the cache only, or None if they're not cached"
+        if not self.cache.are_participants_sync(giveaway_id):
+            return None
+        return self.cache.get_participants(giveaway_id)
+
+    def reserve_cached_participant(self, giveaway_id: str, user_id: int):
+        """Add a participant to the cached list of a giveaway before it's written, so other clicks meanwhile see it
+        add_giveaway_participant removes it again if the write fails"""
+        self.reserved_participants.add((giveaway_id, user_id))
+        self.cache.add_participant(giveaway_id, user_id)
+
+    def release_cached_participant(self, giveaway_id: str, user_id: int):
+        "Remove a participant added by reserve_cached_participant, that won't be written after all"
+        self.reserved_participants.discard((giveaway_id, user_id))
+        self.cache.remove_participant(giveaway_id, user_id)
+
+    @abstractmethod
+    def get_giveaways(self, guild_id: Optional[int]=None) -> AsyncGenerator[GiveawayRecord, None]:
+        "Get a generator of giveaway documents, optionally restricted to a guild"
+
+    @abstractmethod
+    def get_active_giveaways(self) -> AsyncGenerator[GiveawayRecord, None]:
+        "Get a generator of active giveaway documents (ie. not 'ended')"
+
+    @abstractmethod
+    async def query_giveaways(self, guild_id: Optional[int]=None, ended: Optional[bool]=None,
+                              ends_before: Optional[dt]=None, sort: bool=True) -> list[GiveawayRecord]:
+        "Get the giveaways matching the given filters, sorted by end date unless 'sort' is False"
+
+    @abstractmethod
+    async def get_guild_giveaways(self, guild_id: int) -> list[GiveawayRecord]:
+        "Get the giveaway documents of a guild, sorted by end date"
+
+    @abstractmethod
+    async def get_giveaway(self, giveaway_id: str, include_archived: bool=False) -> Optional[GiveawayRecord]:
+        "Get a giveaway document, optionally looking into the archive if it's not found"
+
+    @abstractmethod
+    async def get_archived_giveaways(self, guild_id: int) -> list[GiveawayRecord]:
+        "Get the archived giveaway documents of a guild, sorted by end date"
+
+    @abstractmethod
+    async def archive_giveaways(self, ended_before: dt) -> int:
+        "Archive the giveaways that ended before a given date, and return the number of archived giveaways"
+
+    @abstractmethod
+    async def create_giveaway(self, data: GiveawayData):
+        "Create a giveaway document"
+
+    @abstractmethod
+    async def claim_giveaway_closing(self, giveaway_id: str,
+                                     previous_winners: Optional[list[int]]=None) -> Optional[str]:
+        """Atomically mark a giveaway as ended, only if it's still active (or, for a reroll, if it still has
+        'previous_winners'), and return a claim token if this call claimed it, or None if someone else did"""
+
+    @abstractmethod
+    async def close_giveaway(self, giveaway_id: str, claim: str, winners: list[int]) -> bool:
+        """Save the winners of a giveaway claimed with claim_giveaway_closing, only if no other closing claimed it
+        since, and return whether they were saved"""
+
+    @abstractmethod
+    async def delete_giveaway(self, giveaway_id: str):
+        "Delete a giveaway document and its participants"
+
+    @abstractmethod
+    async def edit_giveaway(self, giveaway_id: str, data: GiveawayRecord):
+        "Edit a giveaway document"
+
+    @abstractmethod
+    async def get_giveaways_participants(self, giveaway_id: str) -> Optional[list[int]]:
+        "Get a list of participants for a giveaway"
+
+    @abstractmethod
+    def iter_giveaway_participants_pages(self, giveaway_id: str
+                                         ) -> AsyncGenerator[list[tuple[int, Optional[dt]]], None]:
+        """Get the participants of a giveaway by pages of (user ID, join date) tuples
+        The join date is None for participants registered before join dates were recorded"""
+
+    @abstractmethod
+    async def check_giveaway_participant(self, giveaway_id: str, user_id: int) -> bool:
+        "Check if a user is a participant of a giveaway"
+
+    @abstractmethod
+    async def add_giveaway_participant(self, giveaway_id: str, user_id: int):
+        """Add a participant to a giveaway, and to its cached participants list
+        If the write fails with an error other than the backend being unavailable, the participant is removed from
+        the cache and the error is raised"""
+
+    @abstractmethod
+    async def get_event_start_timestamp(self) -> Optional[int]:
+        "Get the event start date, or None if the event has finished"
+
+    async def prewarm_cache(self, participants_limit: int, concurrency: int) -> tuple[int, int]:
+        """Load the active giveaways, and the participants of the ones ending soonest, into the cache
+        Participants lists are fetched in parallel, with at most 'concurrency' requests at once
+        Return the number of cached giveaways and participants"""
+        giveaways = await self.query_giveaways(ended=False)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch_participants(giveaway_id: str):
+            async with semaphore:
+                return await self.get_giveaways_participants(giveaway_id)
+
+        participants_lists = await asyncio.gather(*(
+            fetch_participants(gaw.id) for gaw in giveaways[:participants_limit]
+        ))
+        return len(giveaways), sum(len(participants or []) for participants in participants_lists)
+
+    async def check_has_event_started(self) -> bool:
+        "Check if the event has started"
+        ts = await self.get_event_start_timestamp()
+        if ts is None: # start date is none means the event has finished
+            return True
+        return ts < self.clock.time()
+
+    async def check_has_event_finished(self) -> bool:
+        "Check if the event has finished"
+        ts = await self.get_event_start_timestamp()
+        return ts is None # start date is none means the event has finished
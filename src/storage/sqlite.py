@@ -0,0 +1,408 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime as dt
+from datetime import timezone
+from functools import partial
+from typing import AsyncGenerator, Callable, Optional, TypeVar
+
+from src.modules.giveaways.types import GiveawayData, GiveawayRecord
+from src.storage.base import GiveawaysStorage
+from src.utils.clock import Clock
+
+T = TypeVar("T")
+
+SCHEMA = """
+PRAGMA journal_mode = WAL;
+PRAGMA synchronous = NORMAL;
+PRAGMA foreign_keys = ON;
+
+CREATE TABLE IF NOT EXISTS giveaways (
+    id TEXT PRIMARY KEY,
+    guild INTEGER NOT NULL,
+    channel INTEGER NOT NULL,
+    message INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    description TEXT NOT NULL,
+    color INTEGER NOT NULL,
+    max_entries INTEGER,
+    required_role INTEGER,
+    winners_count INTEGER NOT NULL,
+    ends_at REAL NOT NULL,
+    ended INTEGER NOT NULL DEFAULT 0,
+    winners TEXT NOT NULL DEFAULT '[]',
+    closed_by TEXT,
+    archived INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS giveaways_by_state ON giveaways (archived, ended, ends_at);
+CREATE INDEX IF NOT EXISTS giveaways_by_guild ON giveaways (guild, archived, ends_at);
+
+CREATE TABLE IF NOT EXISTS participants (
+    giveaway_id TEXT NOT NULL REFERENCES giveaways (id) ON DELETE CASCADE,
+    user_id INTEGER NOT NULL,
+    joined_at INTEGER,
+    PRIMARY KEY (giveaway_id, user_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS participants_by_join_date ON participants (giveaway_id, joined_at);
+
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value
+) WITHOUT ROWID;
+"""
+
+GIVEAWAY_COLUMNS = "id, guild, channel, message, name, description, color, max_entries, required_role, " \
+    "winners_count, ends_at, ended, winners"
+
+
+def _row_to_record(row: tuple) -> GiveawayRecord:
+    "Build a giveaway record from a 'giveaways' table row, selected with GIVEAWAY_COLUMNS"
+    return GiveawayRecord(
+        row[0], row[1], row[2], row[3], row[4], row[5], row[6], row[7], row[8], row[9],
+        dt.fromtimestamp(row[10], tz=timezone.utc), bool(row[11]), json.loads(row[12])
+    )
+
+def _record_to_row(record: GiveawayRecord) -> tuple:
+    "Convert a giveaway record into a 'giveaways' table row, in the GIVEAWAY_COLUMNS order"
+    return (
+        record.id, record.guild, record.channel, record.message, record.name, record.description, record.color,
+        record.max_entries, record.required_role, record.winners_count, record.ends_at.timestamp(),
+        int(record.ended), json.dumps(record.winners)
+    )
+
+
+class SQLiteStorage(GiveawaysStorage):
+    """Giveaways storage in a local SQLite database, for small deployments and benchmarks
+    The database runs in WAL mode, and every query runs in a single dedicated thread, so the event loop is never
+    blocked and the connection is never used concurrently
+    New participants are buffered for a few milliseconds and inserted by batches, in a single transaction each"""
+
+    # how long new participants are buffered before being inserted, in seconds
+    BATCH_DELAY = 0.05
+    # number of buffered participants that triggers an insertion right away
+    BATCH_SIZE = 500
+
+    def __init__(self, path: str, page_size: int=100, clock: Optional[Clock]=None):
+        super().__init__(clock)
+        self.log = logging.getLogger("cobot.sqlite")
+        self.path = path
+        # number of participants fetched per query when iterating over a participants list
+        self.page_size = page_size
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        # autocommit mode, transactions are opened explicitly
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.executescript(SCHEMA)
+        # databases created before closings were claimed with a token
+        if "closed_by" not in {row[1] for row in self._connection.execute("PRAGMA table_info(giveaways)")}:
+            self._connection.execute("ALTER TABLE giveaways ADD COLUMN closed_by TEXT")
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flush_lock = asyncio.Lock()
+        self._background_tasks: set[asyncio.Task] = set()
+
+    async def _run(self, func: Callable[..., T], *args) -> T:
+        "Run a function using the connection in the database thread"
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(func, *args))
+
+    def _fetch_all(self, query: str, params: tuple=()) -> list[tuple]:
+        "Run a read query and return every row (database thread only)"
+        return self._connection.execute(query, params).fetchall()
+
+    def _write(self, query: str, params: tuple=(), many: bool=False) -> int:
+        "Run a write query in a transaction, with a sequence of parameters if 'many' is set (database thread only)"
+        with self._connection:
+            self._connection.execute("BEGIN IMMEDIATE")
+            if many:
+                return self._connection.executemany(query, params).rowcount
+            return self._connection.execute(query, params).rowcount
+
+    async def close(self):
+        "Write the buffered participants and close the database, even if they can't be written"
+        try:
+            await self.flush_writes()
+        except Exception: # pylint: disable=broad-except
+            self.log.error("Failed to write %s buffered participants before closing", len(self.pending_participants),
+                           exc_info=True)
+        finally:
+            await self._run(self._connection.close)
+            self._executor.shutdown()
+
+    async def flush_writes(self) -> int:
+        "Insert the buffered participants right away, and return how many were inserted"
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        async with self._flush_lock:
+            batch, self.pending_participants = self.pending_participants, []
+            if not batch:
+                return 0
+            try:
+                # participants of a giveaway deleted meanwhile are skipped, as they would fail the whole batch
+                inserted = await self._run(
+                    self._write,
+                    "INSERT OR IGNORE INTO participants (giveaway_id, user_id, joined_at) "
+                    "SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM giveaways WHERE id = ?)",
+                    [(giveaway_id, user_id, joined_at, giveaway_id) for giveaway_id, user_id, joined_at in batch], True
+                )
+            except BaseException:
+                # keep them for the next flush
+                self.pending_participants[:0] = batch
+                raise
+            self.log.debug("Inserted %s participants out of a batch of %s", inserted, len(batch))
+            return inserted
+
+    def _schedule_flush(self):
+        "Insert the buffered participants soon, or right away if the buffer is full"
+        if len(self.pending_participants) >= self.BATCH_SIZE:
+            delay = 0.0
+        elif self._flush_handle is None:
+            delay = self.BATCH_DELAY
+        else:
+            return
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        self._flush_handle = asyncio.get_running_loop().call_later(delay, self._flush_in_background)
+
+    def _flush_in_background(self):
+        "Start inserting the buffered participants in a background task"
+        self._flush_handle = None
+        task = asyncio.create_task(self.flush_writes())
+        self._background_tasks.add(task)
+        task.add_done_callback(self._on_background_flush_done)
+
+    def _on_background_flush_done(self, task: asyncio.Task):
+        "Log a failed background insertion, whose participants stay buffered for the next one"
+        self._background_tasks.discard(task)
+        if not task.cancelled() and (err := task.exception()) is not None:
+            self.log.error("Failed to insert %s buffered participants, they will be retried",
+                           len(self.pending_participants), exc_info=err)
+
+    async def _select_giveaways(self, where: str, params: tuple=()) -> list[GiveawayRecord]:
+        "Get the giveaways matching a WHERE clause, sorted by end date"
+        rows = await self._run(
+            self._fetch_all, f"SELECT {GIVEAWAY_COLUMNS} FROM giveaways WHERE {where} ORDER BY ends_at", params
+        )
+        return [_row_to_record(row) for row in rows]
+
+    async def get_giveaways(self, guild_id: Optional[int]=None) -> AsyncGenerator[GiveawayRecord, None]:
+        "Get a generator of giveaway documents, optionally restricted to a guild"
+        for gaw in await self.query_giveaways(guild_id=guild_id):
+            yield gaw
+
+    async def get_active_giveaways(self) -> AsyncGenerator[GiveawayRecord, None]:
+        """Get a generator of active giveaway documents (ie. not 'ended')
+        Note: this may include giveaways that have a past end date but have not been marked as ended yet"""
+        for gaw in await self.query_giveaways(ended=False):
+            yield gaw
+
+    async def query_giveaways(self, guild_id: Optional[int]=None, ended: Optional[bool]=None,
+                              ends_before: Optional[dt]=None, sort: bool=True) -> list[GiveawayRecord]:
+        """Get the giveaways matching the given filters, sorted by end date unless 'sort' is False
+        Only the active giveaways are read from the database if 'ended' is False"""
+        if ended is False:
+            if not self.cache.are_active_giveaways_sync:
+                self.cache.set_active_giveaways(await self._select_giveaways("archived = 0 AND ended = 0"))
+        elif guild_id is not None:
+            if not self.cache.are_guild_giveaways_sync(guild_id):
+                giveaways = await self._select_giveaways("guild = ? AND archived = 0", (guild_id,))
+                self.cache.set_guild_giveaways(guild_id, giveaways)
+        elif not self.cache.are_giveaways_sync:
+            self.cache.set_giveaways(await self._select_giveaways("archived = 0"))
+        return self.cache.query_giveaways(guild_id=guild_id, ended=ended, ends_before=ends_before, sort=sort)
+
+    async def get_guild_giveaways(self, guild_id: int) -> list[GiveawayRecord]:
+        "Get the giveaway documents of a guild, sorted by end date"
+        return await self.query_giveaways(guild_id=guild_id)
+
+    async def get_giveaway(self, giveaway_id: str, include_archived: bool=False) -> Optional[GiveawayRecord]:
+        "Get a giveaway document, optionally looking into the archive if it's not found"
+        if gaw := self.cache.get_giveaway(giveaway_id):
+            return gaw
+        if include_archived and (gaw := self.cache.get_archived_giveaway(giveaway_id)):
+            return gaw
+        rows = await self._run(
+            self._fetch_all, f"SELECT {GIVEAWAY_COLUMNS}, archived FROM giveaways WHERE id = ?", (giveaway_id,)
+        )
+        if not rows:
+            return None
+        gaw = _row_to_record(rows[0])
+        if rows[0][-1]:
+            if not include_archived:
+                return None
+            self.cache.set_archived_giveaway(gaw)
+        else:
+            self.cache.set_existing_giveaway(gaw)
+        return gaw
+
+    async def get_archived_giveaways(self, guild_id: int) -> list[GiveawayRecord]:
+        "Get the archived giveaway documents of a guild, sorted by end date"
+        if (giveaways := self.cache.get_archived_guild_giveaways(guild_id)) is None:
+            giveaways = await self._select_giveaways("guild = ? AND archived = 1", (guild_id,))
+            self.cache.set_archived_guild_giveaways(guild_id, giveaways)
+        return sorted(giveaways, key=lambda gaw: gaw.ends_at)
+
+    async def archive_giveaways(self, ended_before: dt) -> int:
+        """Flag the giveaways that ended before a given date as archived, and return the number of archived giveaways
+        Their participants stay in place, but are dropped from the cache"""
+        def archive() -> list[str]:
+            with self._connection:
+                self._connection.execute("BEGIN IMMEDIATE")
+                rows = self._connection.execute(
+                    "SELECT id FROM giveaways WHERE archived = 0 AND ended = 1 AND ends_at < ?",
+                    (ended_before.timestamp(),)
+                ).fetchall()
+                self._connection.executemany("UPDATE giveaways SET archived = 1 WHERE id = ?", rows)
+            return [row[0] for row in rows]
+
+        archived_ids = await self._run(archive)
+        for giveaway_id in archived_ids:
+            self.log.info("Archived giveaway %s", giveaway_id)
+            self.cache.archive_giveaway(giveaway_id)
+        return len(archived_ids)
+
+    async def create_giveaway(self, data: GiveawayData):
+        "Create a giveaway document"
+        self.log.info("Creating new giveaway %s", data["id"])
+        record = GiveawayRecord.from_data(data)
+        await self._run(
+            self._write, f"INSERT INTO giveaways ({GIVEAWAY_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            _record_to_row(record)
+        )
+        self.cache.set_new_giveaway(record)
+
+    async def claim_giveaway_closing(self, giveaway_id: str,
+                                     previous_winners: Optional[list[int]]=None) -> Optional[str]:
+        """Mark a giveaway as ended with a new claim token, only if it's still active (or, for a reroll, if it still
+        has 'previous_winners'), and return the token if this call claimed it, or None if someone else did"""
+        self.log.info("Claiming the closing of giveaway %s", giveaway_id)
+        claim = uuid.uuid4().hex
+        if previous_winners is None:
+            condition, params = "ended = 0", ()
+        else:
+            condition, params = "ended = 1 AND winners = ?", (json.dumps(previous_winners),)
+        updated = await self._run(
+            self._write, f"UPDATE giveaways SET ended = 1, closed_by = ? WHERE id = ? AND {condition}",
+            (claim, giveaway_id, *params)
+        )
+        rows = await self._run(self._fetch_all, "SELECT winners FROM giveaways WHERE id = ?", (giveaway_id,))
+        if rows:
+            self.cache.close_giveaway(giveaway_id, json.loads(rows[0][0]))
+        if not updated:
+            self.log.info("Giveaway %s was already closed by someone else", giveaway_id)
+            return None
+        return claim
+
+    async def close_giveaway(self, giveaway_id: str, claim: str, winners: list[int]) -> bool:
+        """Save the winners of a giveaway claimed with claim_giveaway_closing, only if no other closing claimed it
+        since, and return whether they were saved"""
+        self.log.info("Saving winners of giveaway %s", giveaway_id)
+        updated = await self._run(
+            self._write, "UPDATE giveaways SET winners = ? WHERE id = ? AND closed_by = ?",
+            (json.dumps(winners), giveaway_id, claim)
+        )
+        if not updated:
+            self.log.info("Giveaway %s was claimed by someone else meanwhile, not saving its winners", giveaway_id)
+            return False
+        self.cache.close_giveaway(giveaway_id, winners)
+        return True
+
+    async def delete_giveaway(self, giveaway_id: str):
+        "Delete a giveaway document and its participants"
+        self.log.info("Deleting giveaway %s", giveaway_id)
+        # buffered participants would otherwise be inserted after their giveaway is deleted
+        self.pending_participants = [pending for pending in self.pending_participants if pending[0] != giveaway_id]
+        # participants are deleted by the foreign key cascade
+        await self._run(self._write, "DELETE FROM giveaways WHERE id = ?", (giveaway_id,))
+        self.cache.delete_giveaway(giveaway_id)
+
+    async def edit_giveaway(self, giveaway_id: str, data: GiveawayRecord):
+        "Edit a giveaway document"
+        self.log.info("Editing giveaway %s", giveaway_id)
+        row = _record_to_row(data)
+        columns = GIVEAWAY_COLUMNS.split(", ")[1:]
+        await self._run(
+            self._write, f"UPDATE giveaways SET {', '.join(f'{column} = ?' for column in columns)} WHERE id = ?",
+            (*row[1:], giveaway_id)
+        )
+        self.cache.edit_giveaway(giveaway_id, data)
+
+    async def get_giveaways_participants(self, giveaway_id: str) -> Optional[list[int]]:
+        "Get a list of participants for a giveaway, in join order"
+        if self.cache.are_participants_sync(giveaway_id):
+            return self.cache.get_participants(giveaway_id)
+        self.log.debug("Reading participants for giveaway %s", giveaway_id)
+        await self.flush_writes()
+        rows = await self._run(
+            self._fetch_all,
+            "SELECT user_id FROM participants WHERE giveaway_id = ? ORDER BY joined_at, user_id", (giveaway_id,)
+        )
+        participants = [row[0] for row in rows]
+        # participants added while reading are buffered again
+        read_ids = set(participants)
+        participants.extend(
+            user_id for pending_giveaway_id, user_id, _ in self.pending_participants
+            if pending_giveaway_id == giveaway_id and user_id not in read_ids
+        )
+        if not self.cache.is_archived(giveaway_id):
+            self.cache.set_participants(giveaway_id, participants)
+        return participants
+
+    async def iter_giveaway_participants_pages(self, giveaway_id: str
+                                               ) -> AsyncGenerator[list[tuple[int, Optional[dt]]], None]:
+        """Get the participants of a giveaway by pages of user-ID-ordered (user ID, join date) tuples
+        Pages are read with a cursor on the primary key, so each page is a single index range scan"""
+        await self.flush_writes()
+        cursor = -1
+        while True:
+            rows = await self._run(
+                self._fetch_all,
+                "SELECT user_id, joined_at FROM participants WHERE giveaway_id = ? AND user_id > ? "
+                "ORDER BY user_id LIMIT ?",
+                (giveaway_id, cursor, self.page_size)
+            )
+            if rows:
+                yield [
+                    (user_id, None if joined_at is None else dt.fromtimestamp(joined_at / 1000, tz=timezone.utc))
+                    for user_id, joined_at in rows
+                ]
+            if len(rows) < self.page_size:
+                return
+            cursor = rows[-1][0]
+
+    async def check_giveaway_participant(self, giveaway_id: str, user_id: int) -> bool:
+        "Check if a user is a participant of a giveaway"
+        if (participants := self.get_cached_participants(giveaway_id)) is not None:
+            return user_id in participants
+        if any(pending[:2] == (giveaway_id, user_id) for pending in self.pending_participants):
+            return True
+        rows = await self._run(
+            self._fetch_all, "SELECT 1 FROM participants WHERE giveaway_id = ? AND user_id = ?", (giveaway_id, user_id)
+        )
+        return bool(rows)
+
+    async def add_giveaway_participant(self, giveaway_id: str, user_id: int):
+        "Add a participant to a giveaway, which is inserted with the next batch"
+        self.log.debug("Adding participant %s to giveaway %s", user_id, giveaway_id)
+        self.pending_participants.append((giveaway_id, user_id, int(self.clock.time() * 1000)))
+        self.reserved_participants.discard((giveaway_id, user_id))
+        self.cache.add_participant(giveaway_id, user_id)
+        self._schedule_flush()
+
+    async def get_event_start_timestamp(self) -> Optional[int]:
+        "Get the event start date, from the 'event_timestamp' setting"
+        if ts := self.cache.event_start_timestamp:
+            return ts
+        rows = await self._run(self._fetch_all, "SELECT value FROM settings WHERE key = 'event_timestamp'")
+        if not rows or not isinstance(rows[0][0], (int, float)):
+            return None
+        self.cache.event_start_timestamp = int(rows[0][0])
+        return self.cache.event_start_timestamp
+
+    async def set_event_start_timestamp(self, timestamp: Optional[int]):
+        "Set the event start date, or mark the event as finished if None"
+        await self._run(
+            self._write, "INSERT OR REPLACE INTO settings (key, value) VALUES ('event_timestamp', ?)", (timestamp,)
+        )
+        self.cache.event_start_timestamp = timestamp
@@ -0,0 +1,84 @@
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+import discord
+
+
+class Clock:
+    "Source of the current time, so code relying on it can be run faster than real time"
+
+    speed = 1.0
+
+    def now(self) -> datetime:
+        "Get the current aware UTC datetime"
+        return discord.utils.utcnow()
+
+    def time(self) -> float:
+        "Get the current UNIX timestamp"
+        return time.time()
+
+    def to_real_datetime(self, date: datetime) -> datetime:
+        "Convert a date of this clock into the real date at which it will be reached, for real-time schedulers"
+        return date
+
+    def to_real_seconds(self, seconds: float) -> float:
+        "Convert a duration of this clock into a real duration"
+        return seconds
+
+
+class WarpClock(Clock):
+    """Clock starting at a given date and running 'speed' times faster than real time, which can also be moved
+    forward manually
+    Used to try a long period of giveaways in a short time on a test bot. It follows real time, so runs are not
+    reproducible, advance() doesn't move the closings already scheduled, and the warped dates are written into the
+    database: it must never be used with a production database (see ManualClock for deterministic simulations)"""
+
+    def __init__(self, start: Optional[datetime]=None, speed: float=1.0):
+        if speed <= 0:
+            raise ValueError("speed must be positive")
+        self.speed = speed
+        self._start = start or discord.utils.utcnow()
+        self._real_start = time.monotonic()
+        self._offset = timedelta()
+
+    def now(self):
+        elapsed = timedelta(seconds=(time.monotonic() - self._real_start) * self.speed)
+        return self._start + elapsed + self._offset
+
+    def time(self):
+        return self.now().timestamp()
+
+    def to_real_datetime(self, date: datetime):
+        return discord.utils.utcnow() + timedelta(seconds=self.to_real_seconds((date - self.now()).total_seconds()))
+
+    def to_real_seconds(self, seconds: float):
+        return seconds / self.speed
+
+    def advance(self, delta: timedelta):
+        "Move the clock forward"
+        self._offset += delta
+
+
+class ManualClock(Clock):
+    """Clock that only moves when advance() is called, for deterministic simulations
+    Real-time schedulers would never reach its dates, so code using it must be driven directly, like in
+    benchmarks/giveaways_simulation.py"""
+
+    def __init__(self, start: datetime):
+        self._now = start
+
+    def now(self):
+        return self._now
+
+    def time(self):
+        return self._now.timestamp()
+
+    def to_real_datetime(self, date: datetime):
+        return discord.utils.utcnow() + (date - self._now)
+
+    def advance(self, delta: timedelta):
+        "Move the clock forward"
+        if delta < timedelta():
+            raise ValueError("the clock can't go backwards")
+        self._now += delta
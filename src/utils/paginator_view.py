@@ -120,3 +120,75 @@ class Paginator(ui.View):
         "Jump to the last page"
         await self._set_page(interaction, await self.get_page_count())
         await self._update_contents(interaction)
+
+
+class StatelessPaginator:
+    """Base class to paginate something without keeping any state in memory
+    The page number, the allowed user and the data key are encoded in the buttons custom_id, and each click rebuilds
+    the page from scratch: open paginators cost no memory and keep working after a restart.
+    Instances must be registered with `CObot.add_stateless_paginator` to receive clicks."""
+
+    CUSTOM_ID_PREFIX = "pg"
+    BUTTONS: tuple[tuple[str, ButtonStyle], ...] = (
+        ('\U000025c0 \U000025c0', ButtonStyle.secondary),
+        ('\U000025c0', ButtonStyle.blurple),
+        ('...', ButtonStyle.red),
+        ('\U000025b6', ButtonStyle.blurple),
+        ('\U000025b6 \U000025b6', ButtonStyle.secondary),
+    )
+
+    def __init__(self, client: CObot, name: str, stop_label: str="Quit"):
+        if '-' in name:
+            raise ValueError("Paginator name can't contain dashes")
+        self.client = client
+        self.name = name
+        self.stop_label = stop_label
+
+    async def get_page_content(self, interaction: Interaction, key: str, page: int) -> dict[str, Any]:
+        "Build the page content given the data key, the page number and source interaction"
+        raise NotImplementedError("get_page_content must be implemented!")
+
+    async def get_page_count(self, interaction: Interaction, key: str) -> int:
+        "Get total number of available pages for a data key"
+        raise NotImplementedError("get_page_count must be implemented!")
+
+    async def send_init(self, interaction: Interaction, key: str):
+        "Build the first page, before anyone actually click"
+        contents = await self.get_page_content(interaction, key, 1)
+        view = self.build_view(interaction.user.id, key, 1, await self.get_page_count(interaction, key))
+        if interaction.response.is_done():
+            await interaction.followup.send(**contents, view=view)
+        else:
+            await interaction.response.send_message(**contents, view=view)
+
+    def build_view(self, user_id: int, key: str, page: int, count: int, stopped: bool=False) -> ui.View:
+        """Build the navigation buttons for a given page
+        The view is stopped right away so discord.py doesn't keep it in its views store"""
+        view = ui.View(timeout=None)
+        if count > 1:
+            targets = (1, page - 1, page, page + 1, count)
+            for slot, ((label, style), target) in enumerate(zip(self.BUTTONS, targets)):
+                view.add_item(ui.Button(
+                    label=self.stop_label if slot == 2 else label,
+                    style=style,
+                    custom_id=f"{self.CUSTOM_ID_PREFIX}-{self.name}-{slot}-{target}-{user_id}-{key}",
+                    disabled=stopped or (slot != 2 and (target < 1 or target > count or target == page)),
+                ))
+        view.stop()
+        return view
+
+    async def on_click(self, interaction: Interaction, custom_id: str):
+        "Handle a click on one of the navigation buttons"
+        _, _, slot, page, user_id, key = custom_id.split('-', 5)
+        if interaction.user.id != int(user_id):
+            await interaction.response.send_message("You cannot use that!", ephemeral=True)
+            return
+        await interaction.response.defer()
+        count = await self.get_page_count(interaction, key)
+        page = min(max(int(page), 1), count)
+        contents = await self.get_page_content(interaction, key, page)
+        view = self.build_view(int(user_id), key, page, count, stopped=(slot == "2"))
+        if interaction.message is None:
+            self.client.dispatch("error", "No message to update", interaction)
+            return
+        await interaction.followup.edit_message(interaction.message.id, view=view, **contents)
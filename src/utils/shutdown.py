@@ -0,0 +1,39 @@
+import asyncio
+from contextlib import contextmanager
+
+
+class ShutdownState:
+    "State of a graceful shutdown or restart: the ongoing work to wait for, and what to do once the bot is closed"
+
+    def __init__(self, cache_snapshot_file: str, cache_snapshot_max_age: float=600):
+        # set when shutting down, to stop accepting new component interactions
+        self.draining = False
+        # set by /admin reboot, for start.py to restart the process once the bot is cleanly closed
+        self.restart_requested = False
+        # cache content saved before a restart, loaded back if the restart was quick enough
+        self.cache_snapshot_file = cache_snapshot_file
+        self.cache_snapshot_max_age = cache_snapshot_max_age
+        # number of interactions and jobs being processed, and whether there are none
+        self.ongoing_work = 0
+        self._no_ongoing_work = asyncio.Event()
+        self._no_ongoing_work.set()
+
+    @contextmanager
+    def track_work(self):
+        "Mark some interaction or job as ongoing for the duration of the context"
+        self.ongoing_work += 1
+        self._no_ongoing_work.clear()
+        try:
+            yield
+        finally:
+            self.ongoing_work -= 1
+            if self.ongoing_work == 0:
+                self._no_ongoing_work.set()
+
+    async def wait_for_ongoing_work(self, timeout: float) -> bool:
+        "Wait until no work is ongoing, within a timeout, and return whether it finished"
+        try:
+            await asyncio.wait_for(self._no_ongoing_work.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
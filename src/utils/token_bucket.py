@@ -0,0 +1,49 @@
+import time
+from typing import Generic, Hashable, Optional, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+
+
+class TokenBucketLimiter(Generic[K]):
+    """Rate limit actions per key, allowing short bursts
+    Each key has a bucket of 'capacity' tokens, refilled at 'rate' tokens per second, and each action takes a token.
+    Buckets are refilled lazily when used, so there is no background task, and full buckets are forgotten from time
+    to time to keep memory bounded."""
+
+    def __init__(self, rate: float, capacity: float):
+        if rate <= 0 or capacity < 1:
+            raise ValueError("rate must be positive and capacity at least 1")
+        self.rate = rate
+        self.capacity = capacity
+        # key -> [available tokens, last refill time, refused actions in a row]
+        self._buckets: dict[K, list[float]] = {}
+        self._prune_threshold = 1024
+
+    def consume(self, key: K, now: Optional[float]=None) -> int:
+        """Try to take a token for an action
+        Return 0 if the action is allowed, otherwise the number of actions refused in a row for this key"""
+        if now is None:
+            now = time.monotonic()
+        if (bucket := self._buckets.get(key)) is None:
+            if len(self._buckets) >= self._prune_threshold:
+                self._prune(now)
+            bucket = self._buckets[key] = [self.capacity, now, 0]
+        else:
+            bucket[0] = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            bucket[2] = 0
+            return 0
+        bucket[2] += 1
+        return int(bucket[2])
+
+    def _prune(self, now: float):
+        "Forget the buckets that are full again, as they behave like new ones"
+        refill_duration = self.capacity / self.rate
+        self._buckets = {
+            key: bucket for key, bucket in self._buckets.items()
+            if now - bucket[1] < refill_duration
+        }
+        # amortize pruning when most buckets are still in use
+        self._prune_threshold = max(1024, 2 * len(self._buckets))
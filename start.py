@@ -21,6 +21,7 @@ check_libs()
 
 import discord
 import asyncio
+import os
 
 from src.boot_utils import load_cogs, setup_logger, setup_start_parser
 from src.cobot import CObot
@@ -55,6 +56,9 @@ async def main():
             token = client.config["DISCORD_RELEASE_TOKEN"]
         await client.start(token)
 
+    if client.shutdown_state.restart_requested:
+        os.execl(sys.executable, sys.executable, *sys.argv)
+
 
 if __name__ == "__main__":
     asyncio.run(main())